@@ -0,0 +1,95 @@
+"""Encode/decode throughput and payload size of DragonManager codecs
+
+run from the ORM directory: python -m benchmarks.codec_bench [--rounds N]
+"""
+
+from argparse import ArgumentParser
+from datetime import datetime, UTC, timedelta
+from time import perf_counter
+from typing import Any, Callable, Dict, List
+import random
+from bson import ObjectId
+from models.Codec import Codec, FastCodec, PickleZlibCodec, lz4_frame
+from models.user_service.User import User
+
+
+def make_user(i: int) -> Dict[str, Any]:
+    """Mongo shaped user, about half of them with filled socials"""
+    user = User(
+        nickname=f"player_{i}_{random.choice(['fox', 'mask', 'yin', 'yang'])}",
+        gender=random.choice(["", "male", "female"]),
+        league_roles=random.sample(["TOP", "JG", "MID", "ADC", "SUP"], k=3),
+        riot_accounts=[
+            f"https://op.gg/summoners/euw/player{i}-{n}"
+            for n in range(random.randint(0, 3))
+        ],
+        created_at=datetime.now(UTC) - timedelta(days=random.randint(0, 900)),
+    )
+    if i % 2:
+        user.socials.discord = {"handle": f"player{i}", "id": str(10**17 + i)}
+        user.socials.twitch = {"channel": f"https://twitch.tv/player{i}"}
+    document = user.model_dump(exclude={"id"})
+    document["_id"] = ObjectId()
+    return document
+
+
+def best_us(fn: Callable[[], Any], rounds: int, repeat: int = 5) -> float:
+    """Best of repeat timings, the others measure whatever else ran"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(rounds):
+            fn()
+        best = min(best, perf_counter() - start)
+    return best / rounds * 1e6
+
+
+def bench(codec: Codec, data: Any, rounds: int) -> Dict[str, float]:
+    encoded = codec.encode(data)
+    return {
+        "bytes": len(encoded),
+        "encode_us": best_us(lambda: codec.encode(data), rounds),
+        "decode_us": best_us(lambda: codec.decode(encoded), rounds),
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+    random.seed(0)
+
+    codecs: Dict[str, Codec] = {
+        "pickle+zlib6 (old)": PickleZlibCodec(),
+        "orjson+zlib6 (default)": FastCodec(),
+        "orjson+zlib1": FastCodec("orjson", level=1),
+        "orjson raw": FastCodec("orjson", threshold=2**62),
+        "msgpack+zlib6": FastCodec("msgpack", level=6),
+        "msgpack+zlib1": FastCodec("msgpack", level=1),
+        "msgpack raw": FastCodec("msgpack", threshold=2**62),
+    }
+    if lz4_frame is not None:
+        codecs["orjson+lz4"] = FastCodec("orjson", "lz4")
+        codecs["msgpack+lz4"] = FastCodec("msgpack", "lz4")
+
+    datasets: Dict[str, List[Dict[str, Any]]] = {
+        "1 user": [make_user(0)],
+        "20 users": [make_user(i) for i in range(20)],
+        "500 users": [make_user(i) for i in range(500)],
+    }
+    for name, documents in datasets.items():
+        entry = {"data": documents, "soft_expire": 0.0}
+        rounds = max(args.rounds // len(documents), 20)
+        print(f"\n{name} ({rounds} rounds)")
+        print(f"{'codec':<22}{'bytes':>10}{'encode us':>12}{'decode us':>12}")
+        # default threshold compresses above 1KiB
+        for codec_name, codec in codecs.items():
+            result = bench(codec, entry, rounds)
+            print(
+                f"{codec_name:<22}{result['bytes']:>10}"
+                f"{result['encode_us']:>12.1f}{result['decode_us']:>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""Latency, throughput and allocations of CRUD over the user data managers
+
+Runs against mongomock_motor + fakeredis (bench dependency group), or against
+real mongod / dragonfly when MONGO_DB_URI and REDIS_URI are set. Real runs use
+the MONGO_BENCH_DB database (default AkioraBench) and drop its users
+collection first, never point it at production data.
+
+run from the ORM directory:
+    python -m benchmarks.crud_bench [--concurrency N] [--requests N]
+        [--scenarios get_by_id,list] [--stack full|mongo]
+        [--save baseline.json] [--compare baseline.json]
+
+bulk_create ops are batches of 100 users. --compare exits with 1 when p95
+or ops/sec regressed more than --tolerance.
+"""
+
+from argparse import ArgumentParser
+from asyncio import gather, run
+from datetime import datetime, UTC
+from itertools import count
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, List
+import json
+import os
+import platform
+import random
+import sys
+import tracemalloc
+from db_clients import DragonClient, MongoDB
+from helpers.CRUD_instances import (
+    DragonUserManager,
+    LocalUserManager,
+    MongoUserManager,
+    user_crud,
+)
+from models.CRUD import CRUD
+from models.user_service.User import User
+from schemas.user_service.User import CreateUser, GetUser
+
+Scenario = Callable[[int], Awaitable[Any]]
+
+_NICKNAMES_PER_QUERY = 10
+_PAGE_SIZE = 50
+_BULK_SIZE = 100
+# ops measured under tracemalloc, it slows them down several times
+_ALLOCATION_SAMPLES = 200
+
+
+async def connect() -> str:
+    mongo_uri = os.getenv("MONGO_DB_URI")
+    redis_uri = os.getenv("REDIS_URI")
+    if mongo_uri and redis_uri:
+        await MongoDB.connect(mongo_uri, os.getenv("MONGO_BENCH_DB", "AkioraBench"))
+        await DragonClient.connect(redis_uri)
+        return "real"
+    try:
+        import fakeredis
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit(
+            "fakeredis and mongomock-motor are required without MONGO_DB_URI "
+            "and REDIS_URI: uv sync --group bench"
+        )
+    MongoDB._client = AsyncMongoMockClient()
+    MongoDB._db = MongoDB._client["AkioraBench"]
+    DragonClient._client = fakeredis.FakeAsyncRedis()
+    return "fake"
+
+
+async def seed(backend: str, users: int) -> List[User]:
+    collection = await MongoUserManager._get_collection()
+    await collection.drop()
+    # mongomock checks unique indexes by scanning the collection on every
+    # insert and never uses indexes for reads, so they only skew fake runs
+    if backend == "real":
+        await MongoUserManager.sync_indexes()
+    await DragonUserManager.invalidate(None)
+    LocalUserManager.clear()
+    seeded, errors = await user_crud.bulk_create(
+        [CreateUser(nickname=f"seed_{i}") for i in range(users)]
+    )
+    if errors:
+        sys.exit(f"Seeding failed: {errors[:3]}")
+    return seeded
+
+
+def make_scenarios(crud: CRUD, seeded: List[User]) -> Dict[str, Scenario]:
+    ids = [user.id for user in seeded]
+    nicknames = [user.nickname for user in seeded]
+    created = count()
+
+    async def get_by_id(i: int) -> Any:
+        return await crud.get(GetUser(ids=[random.choice(ids)]))
+
+    async def get_by_nicknames(i: int) -> Any:
+        sample = random.sample(nicknames, k=min(_NICKNAMES_PER_QUERY, len(nicknames)))
+        return await crud.get(GetUser(nicknames=sample))
+
+    async def list_page(i: int) -> Any:
+        return await crud.get(GetUser(limit=_PAGE_SIZE, sort="created_at"))
+
+    async def create(i: int) -> Any:
+        return await crud.create(CreateUser(nickname=f"create_{next(created)}"))
+
+    async def bulk_create(i: int) -> Any:
+        batch = next(created)
+        return await crud.bulk_create(
+            [CreateUser(nickname=f"bulk_{batch}_{n}") for n in range(_BULK_SIZE)]
+        )
+
+    return {
+        "get_by_id": get_by_id,
+        "get_by_nicknames": get_by_nicknames,
+        "list": list_page,
+        "create": create,
+        "bulk_create": bulk_create,
+    }
+
+
+async def measure(scenario: Scenario, requests: int, concurrency: int) -> List[float]:
+    latencies: List[float] = []
+    issued = count()
+
+    async def worker() -> None:
+        while (i := next(issued)) < requests:
+            start = perf_counter()
+            await scenario(i)
+            latencies.append(perf_counter() - start)
+
+    await gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+async def measure_allocations(scenario: Scenario, samples: int) -> float:
+    """Mean peak of traced memory above the baseline per sequential request, KiB"""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for i in range(samples):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            await scenario(i)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+    finally:
+        tracemalloc.stop()
+    return sum(peaks) / len(peaks) / 1024
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+async def bench(args) -> Dict[str, Any]:
+    backend = await connect()
+    seeded = await seed(backend, args.users)
+    crud = user_crud
+    if args.stack == "mongo":
+        crud = CRUD(data_managers=[MongoUserManager], model=User)
+    scenarios = make_scenarios(crud, seeded)
+    selected = args.scenarios.split(",") if args.scenarios else list(scenarios)
+
+    results = {}
+    try:
+        for name in selected:
+            scenario = scenarios[name]
+            requests = args.requests
+            if name == "bulk_create":
+                requests = max(requests // _BULK_SIZE, args.concurrency)
+            await measure(
+                scenario, min(requests, args.concurrency * 4), args.concurrency
+            )
+            start = perf_counter()
+            latencies = await measure(scenario, requests, args.concurrency)
+            elapsed = perf_counter() - start
+            results[name] = {
+                "requests": requests,
+                "p50_ms": percentile(latencies, 0.50) * 1e3,
+                "p95_ms": percentile(latencies, 0.95) * 1e3,
+                "p99_ms": percentile(latencies, 0.99) * 1e3,
+                "ops_per_sec": requests / elapsed,
+                "alloc_kib": await measure_allocations(
+                    scenario, min(_ALLOCATION_SAMPLES, requests)
+                ),
+            }
+    finally:
+        await MongoDB.disconnect()
+        await DragonClient.disconnect()
+
+    return {
+        "meta": {
+            "backend": backend,
+            "stack": args.stack,
+            "concurrency": args.concurrency,
+            "users": args.users,
+            "python": platform.python_version(),
+            "created_at": datetime.now(UTC).isoformat(),
+        },
+        "results": results,
+    }
+
+
+def print_results(report: Dict[str, Any]) -> None:
+    meta = report["meta"]
+    print(
+        f"\nbackend={meta['backend']} stack={meta['stack']} "
+        f"concurrency={meta['concurrency']} users={meta['users']}"
+    )
+    print(
+        f"{'scenario':<18}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'p99 ms':>9}{'ops/sec':>10}{'alloc KiB':>11}"
+    )
+    for name, result in report["results"].items():
+        print(
+            f"{name:<18}{result['requests']:>9}{result['p50_ms']:>9.2f}"
+            f"{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+            f"{result['ops_per_sec']:>10.0f}{result['alloc_kib']:>11.1f}"
+        )
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> bool:
+    """Prints changes against baseline, False when anything regressed"""
+    for setting in ("backend", "stack", "concurrency", "users"):
+        if report["meta"][setting] != baseline["meta"][setting]:
+            print(f"WARNING baseline was recorded with another {setting}")
+    ok = True
+    print(f"\n{'scenario':<18}{'p95 change':>12}{'ops/sec change':>16}")
+    for name, result in report["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<18}{'no baseline':>12}")
+            continue
+        if result["requests"] != base["requests"]:
+            print(f"WARNING {name} baseline ran {base['requests']} requests")
+        p95_change = result["p95_ms"] / base["p95_ms"] - 1
+        ops_change = result["ops_per_sec"] / base["ops_per_sec"] - 1
+        regressed = p95_change > tolerance or ops_change < -tolerance
+        ok = ok and not regressed
+        print(
+            f"{name:<18}{p95_change:>+12.1%}{ops_change:>+16.1%}"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    return ok
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--scenarios", help="comma separated, all by default")
+    parser.add_argument("--stack", choices=("full", "mongo"), default="full")
+    parser.add_argument("--save", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    random.seed(0)
+
+    report = run(bench(args))
+    print_results(report)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if not compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
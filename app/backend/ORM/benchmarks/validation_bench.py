@@ -0,0 +1,82 @@
+"""Per document validation and serialization cost of CRUD read results
+
+run from the ORM directory: python -m benchmarks.validation_bench [--documents N]
+"""
+
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import Any, Callable, Dict, List
+import json
+import random
+import warnings
+from fastapi.encoders import jsonable_encoder
+from benchmarks.codec_bench import make_user
+from models.CRUD import CRUD
+from models.user_service.User import User
+
+
+def per_document_us(
+    fn: Callable[[], Any], documents: int, rounds: int, repeat: int = 5
+) -> float:
+    """Best of repeat timings, the others measure whatever else ran"""
+    fn()
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(rounds):
+            fn()
+        best = min(best, perf_counter() - start)
+    return best / rounds / documents * 1e6
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--documents", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    random.seed(0)
+
+    data: List[Dict[str, Any]] = [make_user(i) for i in range(args.documents)]
+    crud = CRUD(data_managers=[], model=User)
+    trusted_crud = CRUD(data_managers=[], model=User, trust_storage=True)
+    # as stored, users without socials or riot accounts lack those fields
+    stored = [User.to_storage(item) for item in data]
+    validated = crud.validate_many(data)
+    constructed = trusted_crud.validate_many(data)
+    assert crud.encode_response(validated) == trusted_crud.encode_response(constructed)
+    assert crud.encode_response(
+        crud.validate_many(stored)
+    ) == trusted_crud.encode_response(trusted_crud.validate_many(stored))
+
+    validation = {
+        "model_validate per item (old)": lambda: [
+            User.model_validate(item) for item in data
+        ],
+        "TypeAdapter[list[User]]": lambda: crud.validate_many(data),
+        "construct_trusted (trust_storage)": lambda: trusted_crud.validate_many(data),
+        "model_construct per item": lambda: [
+            User.model_construct(**item) for item in data
+        ],
+        "TypeAdapter[list[User]], stored": lambda: crud.validate_many(stored),
+        "construct_trusted, stored": lambda: trusted_crud.validate_many(stored),
+    }
+    serialization = {
+        "jsonable_encoder + json (FastAPI default)": lambda: json.dumps(
+            jsonable_encoder(validated)
+        ).encode(),
+        "CRUD.encode_response": lambda: crud.encode_response(validated),
+        "CRUD.encode_response (constructed)": lambda: trusted_crud.encode_response(
+            constructed
+        ),
+    }
+    for title, cases in (("validation", validation), ("serialization", serialization)):
+        print(f"\n{title}, {args.documents} documents, us per document")
+        for name, fn in cases.items():
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")
+                cost = per_document_us(fn, args.documents, args.rounds)
+            print(f"{name:<44}{cost:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Rewrites existing documents in their sparse storage form
+
+Fields listed in a model's _sparse_fields are dropped while they hold their
+default, new documents are already written that way. Run once after
+deploying a model with new sparse fields, --dry-run only reports.
+
+run from the ORM directory:
+    python compact.py [--dry-run] [--batch-size N] [--invalidate-cache]
+
+Dragon entries cached before compaction keep their full documents until they
+expire, --invalidate-cache drops them right away.
+"""
+
+from argparse import ArgumentParser
+from asyncio import run
+import os
+from db_clients import DragonClient, MongoDB
+from helpers.CRUD_instances import user_crud
+from models.data_managers.DragonManager import DragonManager
+
+
+async def compact(args) -> None:
+    await MongoDB.connect(os.getenv("MONGO_DB_URI", ""), "Akiora")
+    try:
+        for manager in user_crud.data_managers:
+            if not hasattr(manager, "compact"):
+                continue
+            report = await manager.compact(args.batch_size, dry_run=args.dry_run)
+            print_report(manager._get_data_storage(), report, args.dry_run)
+    finally:
+        await MongoDB.disconnect()
+
+    if args.invalidate_cache and not args.dry_run:
+        await DragonClient.connect(os.getenv("REDIS_URI", ""))
+        try:
+            for manager in user_crud.data_managers:
+                if issubclass(manager, DragonManager):
+                    dropped = await manager.invalidate(None)
+                    print(f"{manager._get_data_storage()} dropped {dropped} keys")
+        finally:
+            await DragonClient.disconnect()
+
+
+def print_report(storage: str, report, dry_run: bool) -> None:
+    documents = report["documents"] or 1
+    saved = report["bytes_before"] - report["bytes_after"]
+    verb = "would compact" if dry_run else "compacted"
+    print(
+        f"{storage}: {verb} {report['compacted']} of {report['documents']} documents\n"
+        f"  bytes per document {report['bytes_before'] / documents:.0f} -> "
+        f"{report['bytes_after'] / documents:.0f}, "
+        f"saved {saved / documents:.0f} ({saved / (report['bytes_before'] or 1):.1%}), "
+        f"{saved / 1024 / 1024:.2f} MiB in total"
+    )
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--invalidate-cache", action="store_true")
+    run(compact(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
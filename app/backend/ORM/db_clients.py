@@ -1,31 +1,129 @@
+from asyncio import gather
+from time import perf_counter
+from typing import Any, Dict
 from motor.motor_asyncio import (
     AsyncIOMotorClient,
     AsyncIOMotorCollection,
     AsyncIOMotorDatabase,
 )
-from redis.asyncio.connection import ConnectionPool
+from pymongo import monitoring
+from redis.asyncio.connection import BlockingConnectionPool
 from redis.asyncio import Redis
 
-# TODO : create indexes on startup for mongo
+
+class _PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool counters, summed over all servers of the client"""
+
+    def __init__(self) -> None:
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checked_in = 0
+        self.checkout_failed = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "open": self.created - self.closed,
+            "in_use": self.checked_out - self.checked_in,
+            "checkouts": self.checked_out,
+            "checkout_failed": self.checkout_failed,
+        }
+
+    def connection_created(self, event) -> None:
+        self.created += 1
+
+    def connection_closed(self, event) -> None:
+        self.closed += 1
+
+    def connection_checked_out(self, event) -> None:
+        self.checked_out += 1
+
+    def connection_checked_in(self, event) -> None:
+        self.checked_in += 1
+
+    def connection_check_out_failed(self, event) -> None:
+        self.checkout_failed += 1
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        pass
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_check_out_started(self, event) -> None:
+        pass
 
 
 class MongoDB:
     _client: AsyncIOMotorClient | None = None
     _db: AsyncIOMotorDatabase | None = None
+    _pool_stats: _PoolStats | None = None
+    _max_pool_size: int = 100
 
     @classmethod
-    async def connect(cls, uri: str, db_name: str) -> None:
+    async def connect(
+        cls,
+        uri: str,
+        db_name: str,
+        *,
+        max_pool_size: int = 100,
+        min_pool_size: int = 0,
+        max_idle_time_ms: int | None = None,
+        wait_queue_timeout_ms: int | None = None,
+        server_selection_timeout_ms: int = 5000,
+        connect_timeout_ms: int = 10000,
+        socket_timeout_ms: int | None = None,
+    ) -> None:
+        """pymongo always enables TCP keepalive on its sockets"""
+        cls._pool_stats = _PoolStats()
+        cls._max_pool_size = max_pool_size
         cls._client = AsyncIOMotorClient(
             uri,
-            serverSelectionTimeoutMS=5000,
-            connectTimeoutMS=10000,
+            maxPoolSize=max_pool_size,
+            minPoolSize=min_pool_size,
+            maxIdleTimeMS=max_idle_time_ms,
+            waitQueueTimeoutMS=wait_queue_timeout_ms,
+            serverSelectionTimeoutMS=server_selection_timeout_ms,
+            connectTimeoutMS=connect_timeout_ms,
+            socketTimeoutMS=socket_timeout_ms,
+            event_listeners=[cls._pool_stats],
         )
         cls._db = cls._client[db_name]
 
+    @classmethod
+    async def warmup(cls, connections: int) -> None:
+        """Opens `connections` connections now instead of on first requests"""
+        db = cls.get_db()
+        await gather(*(db.command("ping") for _ in range(connections)))
+
+    @classmethod
+    async def ping(cls) -> float:
+        """Round trip in seconds, raises when the server is unreachable"""
+        started = perf_counter()
+        await cls.get_db().command("ping")
+        return perf_counter() - started
+
+    @classmethod
+    def pool_stats(cls) -> Dict[str, Any]:
+        if cls._pool_stats is None:
+            return {}
+        return {**cls._pool_stats.as_dict(), "max": cls._max_pool_size}
+
     @classmethod
     async def disconnect(cls) -> None:
         if cls._client:
             cls._client.close()
+            cls._client = None
+            cls._db = None
 
     @classmethod
     def get_db(cls) -> AsyncIOMotorDatabase:
@@ -35,19 +133,66 @@ class MongoDB:
 
 
 class DragonClient:
-    _pool: ConnectionPool | None = None
+    _pool: BlockingConnectionPool | None = None
     _client: Redis | None = None
 
     @classmethod
-    async def connect(cls, uri: str) -> None:
-        cls._pool = ConnectionPool.from_url(uri)
+    async def connect(
+        cls,
+        uri: str,
+        *,
+        max_connections: int = 100,
+        pool_timeout: float | None = 5.0,
+        socket_timeout: float | None = None,
+        socket_connect_timeout: float | None = 5.0,
+        socket_keepalive: bool = True,
+        health_check_interval: int = 0,
+    ) -> None:
+        """Callers wait up to pool_timeout for a free connection once
+        max_connections are in use, instead of opening unbounded ones"""
+        cls._pool = BlockingConnectionPool.from_url(
+            uri,
+            max_connections=max_connections,
+            timeout=pool_timeout,
+            socket_timeout=socket_timeout,
+            socket_connect_timeout=socket_connect_timeout,
+            socket_keepalive=socket_keepalive,
+            health_check_interval=health_check_interval,
+        )
         cls._client = Redis.from_pool(cls._pool)
 
+    @classmethod
+    async def warmup(cls, connections: int) -> None:
+        """Opens `connections` connections now instead of on first requests"""
+        client = cls.get_client()
+        await gather(*(client.ping() for _ in range(connections)))
+
+    @classmethod
+    async def ping(cls) -> float:
+        """Round trip in seconds, raises when the server is unreachable"""
+        started = perf_counter()
+        await cls.get_client().ping()
+        return perf_counter() - started
+
+    @classmethod
+    def pool_stats(cls) -> Dict[str, Any]:
+        if cls._pool is None:
+            return {}
+        in_use = len(cls._pool._in_use_connections)
+        idle = len(cls._pool._available_connections)
+        return {
+            "open": in_use + idle,
+            "in_use": in_use,
+            "max": cls._pool.max_connections,
+        }
+
     @classmethod
     async def disconnect(cls) -> None:
         if cls._client:
+            # from_pool clients close their pool with them
             await cls._client.aclose()
             cls._client = None
+            cls._pool = None
 
     @classmethod
     def get_client(cls) -> Redis:
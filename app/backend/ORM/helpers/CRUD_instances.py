@@ -1,6 +1,7 @@
 from models.CRUD import CRUD
 from models.data_managers.MongoManager import MongoManager
 from models.data_managers.DragonManager import DragonManager
+from models.data_managers.LocalManager import LocalManager
 from models.user_service.User import User
 
 
@@ -12,4 +13,16 @@ class DragonUserManager(DragonManager[User]):
     _model_class = User
 
 
-user_crud = CRUD(data_managers=[MongoUserManager, DragonUserManager], model=User)
+class LocalUserManager(LocalManager[User]):
+    _model_class = User
+
+
+user_crud = CRUD(
+    data_managers=[MongoUserManager, LocalUserManager, DragonUserManager],
+    model=User,
+    read_through=True,
+    coalesce_reads=True,
+    batch_writes=True,
+    hedge_reads=True,
+    deadline=3.0,
+)
@@ -0,0 +1,196 @@
+from asyncio import CancelledError, Future, get_running_loop, timeout as asyncio_timeout
+from collections import deque
+from contextlib import asynccontextmanager
+from math import ceil, sqrt
+from time import perf_counter
+from typing import AsyncIterator, ClassVar, Deque, Dict, List
+from helpers.metrics import metrics
+
+# EWMA weights of the short term latency and of the long term (no load) one
+_SHORT_ALPHA = 0.1
+_LONG_ALPHA = 2 / 601
+# limit multiplier after a slot ended in a timeout or connection error
+_BACKOFF = 0.9
+
+
+class Overloaded(Exception):
+    """No slot was free within max_wait, or the wait queue was full"""
+
+    def __init__(self, limiter: str, reason: str, retry_after: int) -> None:
+        super().__init__(f"{limiter} overloaded ({reason})")
+        self.limiter = limiter
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """Concurrency limit with a bounded priority wait queue, adapted to latency
+
+    Requests over the limit wait up to max_wait seconds in the queue of their
+    priority (0 first), a full queue rejects the newcomer unless it can evict
+    a waiter of a lower priority. Rejections raise Overloaded with a
+    Retry-After estimate.
+
+    The limit follows the gradient of the long term latency over the short
+    term one (Netflix gradient2): it grows by about sqrt(limit) while slots
+    take at most `tolerance` times their usual latency, shrinks as they get
+    slower, and by _BACKOFF after a timeout or connection error. It only
+    grows while at least half of it is in use.
+    """
+
+    _registry: ClassVar[Dict[str, "AdaptiveLimiter"]] = {}
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        initial_limit: int = 20,
+        min_limit: int = 4,
+        max_limit: int = 100,
+        max_queue: int = 200,
+        max_wait: float = 1.0,
+        tolerance: float = 2.0,
+        smoothing: float = 0.2,
+        priorities: int = 2,
+    ) -> None:
+        self.name = name
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self._queued = 0
+        self._waiters: List[Deque[Future]] = [deque() for _ in range(priorities)]
+        self._short_latency = 0.0
+        self._long_latency = 0.0
+        AdaptiveLimiter._registry[name] = self
+
+    @asynccontextmanager
+    async def slot(self, priority: int = 0, adapt: bool = True) -> AsyncIterator[None]:
+        """Holds a slot for the body, raises Overloaded when none is given
+
+        adapt False keeps the latency and errors of the body out of the
+        limit, for work whose duration says nothing about congestion.
+        """
+        await self.acquire(priority)
+        started = perf_counter()
+        try:
+            yield
+        except CancelledError:
+            self.release(None)
+            raise
+        except (TimeoutError, ConnectionError):
+            self.release(perf_counter() - started if adapt else None, dropped=adapt)
+            raise
+        except BaseException:
+            self.release(perf_counter() - started if adapt else None)
+            raise
+        self.release(perf_counter() - started if adapt else None)
+
+    async def acquire(self, priority: int = 0) -> None:
+        if self.in_flight < int(self.limit) and not any(self._waiters[: priority + 1]):
+            self.in_flight += 1
+            return
+        if self._queued >= self.max_queue and not self._evict(priority):
+            raise self._rejected(priority, "queue_full")
+
+        waiter = get_running_loop().create_future()
+        self._waiters[priority].append(waiter)
+        self._queued += 1
+        started = perf_counter()
+        try:
+            async with asyncio_timeout(self.max_wait):
+                await waiter
+        except BaseException as e:
+            try:
+                self._waiters[priority].remove(waiter)
+                self._queued -= 1
+            except ValueError:
+                # taken out by _wake or _evict
+                if not waiter.cancelled() and waiter.exception() is None:
+                    # granted as the wait ended, the slot goes to the next waiter
+                    self.release(None)
+            if isinstance(e, TimeoutError):
+                raise self._rejected(priority, "timeout") from None
+            raise
+        metrics.observe(
+            "orm_limiter_wait_seconds",
+            (("limiter", self.name),),
+            perf_counter() - started,
+        )
+
+    def release(self, latency: float | None, dropped: bool = False) -> None:
+        """Frees a slot, latency None when the call ended without telling it"""
+        self.in_flight -= 1
+        if dropped:
+            self.limit = max(self.min_limit, self.limit * _BACKOFF)
+        elif latency is not None:
+            self._adapt(latency)
+        self._wake()
+
+    def retry_after(self) -> int:
+        """Seconds until the queue ahead of a new request is likely through"""
+        queued = self._queued + 1
+        return max(1, ceil(self._short_latency * queued / max(self.limit, 1)))
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": self._queued,
+            "latency_short": self._short_latency,
+            "latency_long": self._long_latency,
+        }
+
+    def _adapt(self, latency: float) -> None:
+        if not self._long_latency:
+            self._short_latency = self._long_latency = latency
+        self._short_latency += _SHORT_ALPHA * (latency - self._short_latency)
+        self._long_latency += _LONG_ALPHA * (latency - self._long_latency)
+        # the long term latency follows a lasting drop faster
+        if self._long_latency > 2 * self._short_latency:
+            self._long_latency *= 0.95
+
+        gradient = max(
+            0.5,
+            min(1.0, self.tolerance * self._long_latency / self._short_latency),
+        )
+        target = self.limit * gradient + sqrt(self.limit)
+        if target > self.limit and self.in_flight < self.limit / 2:
+            return
+        limit = self.limit + self.smoothing * (target - self.limit)
+        self.limit = min(self.max_limit, max(self.min_limit, limit))
+
+    def _wake(self) -> None:
+        for waiters in self._waiters:
+            while waiters and self.in_flight < int(self.limit):
+                waiter = waiters.popleft()
+                self._queued -= 1
+                # cancelled with its request, acquire has yet to clean up
+                if waiter.done():
+                    continue
+                self.in_flight += 1
+                waiter.set_result(None)
+            if waiters:
+                return
+
+    def _evict(self, priority: int) -> bool:
+        """Rejects the newest waiter of the lowest priority below priority"""
+        for lower in range(len(self._waiters) - 1, priority, -1):
+            while self._waiters[lower]:
+                waiter = self._waiters[lower].pop()
+                self._queued -= 1
+                if not waiter.done():
+                    waiter.set_exception(self._rejected(lower, "evicted"))
+                    return True
+        return False
+
+    def _rejected(self, priority: int, reason: str) -> Overloaded:
+        metrics.inc(
+            "orm_limiter_rejected_total",
+            (("limiter", self.name), ("priority", str(priority)), ("reason", reason)),
+        )
+        return Overloaded(self.name, reason, self.retry_after())
@@ -0,0 +1,209 @@
+from bisect import bisect_left
+from functools import lru_cache
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+import os
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+# seconds, upper bounds of the latency histogram buckets
+_LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+# items per flush of a WriteBatcher
+_BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_HELP = {
+    "orm_manager_call_seconds": "DataManager call latency by operation and storage",
+    "orm_manager_errors_total": "Exceptions raised by DataManager calls and swallowed by CRUD",
+    "orm_cache_lookups_total": "Cache manager lookups by result (hit, stale, miss)",
+    "orm_get_served_total": "CRUD.get results by the manager that served them",
+    "orm_validation_errors_total": "Manager results dropped because they failed validation",
+    "orm_write_batch_size": "Items flushed together by a write batcher",
+    "orm_hedged_reads_total": "Reads that started the next manager before the previous answered",
+    "orm_circuit_skips_total": "Manager calls skipped because its circuit breaker was open",
+    "orm_conditional_gets_total": "GETs sent with an ETag by whether If-None-Match matched it",
+    "orm_response_cache_total": "Response cache lookups by result (hit, miss, error)",
+    "orm_limiter_rejected_total": "Requests shed by an admission limiter by priority and reason",
+    "orm_limiter_wait_seconds": "Time admitted requests waited in a limiter queue",
+}
+
+
+class _Histogram:
+    __slots__ = ("bounds", "buckets", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Process local counters and latency histograms in Prometheus text format
+
+    Recording calls return right away when disabled (ORM_METRICS=0), the
+    remaining cost is the perf_counter() call of the caller. Gauges are read
+    from collectors at render time only.
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def inc(self, name: str, labels: Labels, value: float = 1) -> None:
+        if not self.enabled:
+            return
+        series = self._counters.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + value
+
+    def observe(
+        self,
+        name: str,
+        labels: Labels,
+        value: float,
+        bounds: Tuple[float, ...] = _LATENCY_BUCKETS,
+    ) -> None:
+        if not self.enabled:
+            return
+        series = self._histograms.setdefault(name, {})
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = _Histogram(bounds)
+        histogram.observe(value)
+
+    def manager_call(
+        self,
+        operation: str,
+        manager: type,
+        started: float,
+        error: Exception | None = None,
+    ) -> None:
+        """Latency of a DataManager call started at perf_counter() `started`"""
+        if not self.enabled:
+            return
+        labels = _manager_labels(operation, manager)
+        self.observe("orm_manager_call_seconds", labels, perf_counter() - started)
+        if error is not None:
+            self.inc(
+                "orm_manager_errors_total",
+                labels + (("error", type(error).__name__),),
+            )
+
+    def cache_lookup(self, manager: type, result: str) -> None:
+        if not self.enabled:
+            return
+        self.inc(
+            "orm_cache_lookups_total",
+            _manager_labels("get", manager)[1:] + (("result", result),),
+        )
+
+    def served(self, manager: type | None) -> None:
+        if not self.enabled:
+            return
+        name = "none" if manager is None else manager.__name__
+        self.inc("orm_get_served_total", (("manager", name),))
+
+    def batch(self, batcher: str, size: int) -> None:
+        if not self.enabled:
+            return
+        self.observe(
+            "orm_write_batch_size", (("batcher", batcher),), size, _BATCH_BUCKETS
+        )
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        """collector yields (name, labels, value) gauge samples"""
+        self._collectors.append(collector)
+
+    def reset(self) -> None:
+        self._counters.clear()
+        self._histograms.clear()
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for name, series in self._counters.items():
+            _header(lines, name, "counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for name, series in self._histograms.items():
+            _header(lines, name, "histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.bounds, histogram.buckets):
+                    cumulative += count
+                    le = labels + (("le", repr(bound)),)
+                    lines.append(f"{name}_bucket{_format_labels(le)} {cumulative}")
+                le = labels + (("le", "+Inf"),)
+                lines.append(f"{name}_bucket{_format_labels(le)} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum!r}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        gauges: Dict[str, List[str]] = {}
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                gauges.setdefault(name, []).append(
+                    f"{name}{_format_labels(tuple(labels.items()))} "
+                    f"{_format_value(value)}"
+                )
+        for name, samples in gauges.items():
+            _header(lines, name, "gauge")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+@lru_cache(maxsize=1024)
+def _manager_labels(operation: str, manager: type) -> Labels:
+    try:
+        storage = manager._get_data_storage()
+    except Exception:
+        storage = "unknown"
+    return (
+        ("operation", operation),
+        ("manager", manager.__name__),
+        ("storage", storage),
+    )
+
+
+def _header(lines: List[str], name: str, kind: str) -> None:
+    if name in _HELP:
+        lines.append(f"# HELP {name} {_HELP[name]}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+metrics = Metrics(enabled=os.getenv("ORM_METRICS", "1") == "1")
@@ -0,0 +1,61 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic import BaseModel
+import orjson
+from models.DataManager import BadArgs
+
+MAX_PAGE_SIZE = 1000
+# page size of list reads that don't name their users
+DEFAULT_PAGE_SIZE = 100
+
+
+def encode_cursor(sort: str, document: BaseModel) -> str:
+    """Opaque position after document in (sort, _id) order"""
+    value = None if sort == "_id" else getattr(document, sort, None)
+    is_datetime = isinstance(value, datetime)
+    if is_datetime:
+        value = value.isoformat()
+    payload = {"s": sort, "v": value, "d": is_datetime, "i": str(document.id)}
+    return urlsafe_b64encode(orjson.dumps(payload)).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, List[Any]]:
+    """Returns (sort, [sort value, _id]), raises BadArgs on malformed cursors"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = orjson.loads(urlsafe_b64decode(padded))
+        value = payload["v"]
+        if payload["d"]:
+            value = datetime.fromisoformat(value)
+        return payload["s"], [value, ObjectId(payload["i"])]
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise BadArgs(details="Malformed cursor")
+
+
+def keyset_filter(sort: str, after: List[Any]) -> Dict[str, Any]:
+    """Documents strictly after `after` in (sort, _id) order, missing values sort first"""
+    value, last_id = after
+    if sort == "_id":
+        return {"_id": {"$gt": last_id}}
+    if value is None:
+        return {
+            "$or": [
+                {sort: None, "_id": {"$gt": last_id}},
+                {sort: {"$ne": None}},
+            ]
+        }
+    return {
+        "$or": [
+            {sort: {"$gt": value}},
+            {sort: value, "_id": {"$gt": last_id}},
+        ]
+    }
+
+
+def keyset_sort(sort: str) -> List[Tuple[str, int]]:
+    if sort == "_id":
+        return [("_id", 1)]
+    return [(sort, 1), ("_id", 1)]
@@ -0,0 +1,123 @@
+from datetime import datetime
+from hashlib import blake2b
+from typing import Any, Dict, Hashable, List
+from bson import ObjectId
+from pydantic import BaseModel
+import orjson
+
+# serialized queries longer than this are stored under a digest
+MAX_KEY_LENGTH = 256
+# datetimes go through _json_default so they don't equal their isoformat strings
+_JSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def freeze_query(query: Dict[str, Any], options: BaseModel | None = None) -> Hashable:
+    """Hashable form of a mongo query, equal for equivalent queries (see canonical_query)"""
+    if options is None:
+        return _freeze(canonical_query(query))
+    return (
+        _freeze(canonical_query(query)),
+        _freeze(options.model_dump(exclude_none=True)),
+    )
+
+
+def serialize_query(
+    query: Dict[str, Any],
+    options: BaseModel | None = None,
+    max_length: int = MAX_KEY_LENGTH,
+) -> str:
+    """Compact string form of the canonical query, a digest if longer than max_length"""
+    payload: Dict[str, Any] = {"q": canonical_query(query)}
+    if options is not None:
+        payload["o"] = options.model_dump(exclude_none=True)
+    serialized = orjson.dumps(
+        payload, default=_json_default, option=_JSON_OPTIONS
+    ).decode()
+    if len(serialized) > max_length:
+        return "h:" + blake2b(serialized.encode(), digest_size=16).hexdigest()
+    return serialized
+
+
+def canonical_query(query: Any) -> Any:
+    """Equivalent query with one spelling per meaning
+
+    Single condition $and / $or are merged into their parent, nested ones of
+    the same operator flattened, their conditions sorted and deduplicated.
+    $in lists are sorted and deduplicated and a one value $in becomes an
+    equality.
+    """
+    if isinstance(query, list):
+        return [canonical_query(value) for value in query]
+    if not isinstance(query, dict):
+        return query
+
+    result: Dict[str, Any] = {}
+    merged: List[Dict[str, Any]] = []
+    for key, value in query.items():
+        if key in ("$and", "$or") and isinstance(value, list):
+            conditions = _canonical_conditions(key, value)
+            if len(conditions) == 1:
+                merged.append(conditions[0])
+            else:
+                result[key] = conditions
+        elif key == "$in" and isinstance(value, list):
+            result[key] = _sorted_unique(value)
+        else:
+            result[key] = canonical_query(value)
+
+    for condition in merged:
+        if condition.keys() & result.keys():
+            # same field constrained twice, keep the explicit $and
+            result.setdefault("$and", []).append(condition)
+            result["$and"] = _sorted_unique(result["$and"])
+        else:
+            result.update(condition)
+
+    for key, value in result.items():
+        if (
+            isinstance(value, dict)
+            and value.keys() == {"$in"}
+            and len(value["$in"]) == 1
+        ):
+            result[key] = value["$in"][0]
+    return result
+
+
+def _canonical_conditions(operator: str, conditions: List[Any]) -> List[Any]:
+    flat = []
+    for condition in conditions:
+        condition = canonical_query(condition)
+        if isinstance(condition, dict) and condition.keys() == {operator}:
+            flat.extend(condition[operator])
+        else:
+            flat.append(condition)
+    return _sorted_unique(flat)
+
+
+def _sorted_unique(values: List[Any]) -> List[Any]:
+    unique = {_sort_key(value): value for value in values}
+    return [unique[key] for key in sorted(unique)]
+
+
+def _sort_key(value: Any) -> bytes:
+    return orjson.dumps(value, default=_json_default, option=_JSON_OPTIONS)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    return repr(value)
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    return value
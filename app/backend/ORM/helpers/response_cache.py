@@ -0,0 +1,138 @@
+from asyncio import to_thread
+from datetime import timedelta
+from typing import Dict, Tuple
+import gzip
+import orjson
+from db_clients import DragonClient
+from helpers.metrics import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_RESPONSE_TTL = timedelta(minutes=5)
+# smaller bodies are stored and served uncompressed
+_MIN_COMPRESS_SIZE = 1024
+# larger bodies aren't cached
+_MAX_BODY_SIZE = 8 * 1024 * 1024
+# a variant is kept when it is at most this fraction of the body
+_MAX_COMPRESS_RATIO = 0.9
+_GZIP_LEVEL = 6
+_BROTLI_QUALITY = 5
+
+
+class ResponseCache:
+    """Encoded response bodies in Dragonfly, served as the stored bytes
+
+    Entries are keyed by route and the ETag of the response (see CRUD.etag),
+    which changes with every write it covers. Writes don't have to find
+    entries, they stop being asked for and expire after ttl. Bodies of at
+    least min_compress_size are also stored gzip compressed (and brotli,
+    with the brotli extra), a hit is one HMGET of the variant the client's
+    Accept-Encoding prefers.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        *,
+        ttl: timedelta = _RESPONSE_TTL,
+        min_compress_size: int = _MIN_COMPRESS_SIZE,
+        max_body_size: int = _MAX_BODY_SIZE,
+        enabled: bool = True,
+    ) -> None:
+        self.prefix = prefix
+        self.ttl = ttl
+        self.min_compress_size = min_compress_size
+        self.max_body_size = max_body_size
+        self.enabled = enabled
+        # preferred first on equal q values
+        self.encodings = ("br", "gzip") if brotli is not None else ("gzip",)
+
+    def encoding(self, accept_encoding: str | None) -> str:
+        """Stored encoding the client prefers, identity when it accepts none"""
+        if not self.enabled or not accept_encoding:
+            return "identity"
+        accepted: Dict[str, float] = {}
+        for item in accept_encoding.split(","):
+            name, _, params = item.partition(";")
+            q = 1.0
+            params = params.strip().replace(" ", "")
+            if params.startswith("q="):
+                try:
+                    q = float(params[2:])
+                except ValueError:
+                    q = 0.0
+            accepted[name.strip().lower()] = q
+        wildcard = accepted.get("*", 0.0)
+        best = max(self.encodings, key=lambda e: accepted.get(e, wildcard))
+        return best if accepted.get(best, wildcard) > 0 else "identity"
+
+    async def get(
+        self, route: str, etag: str, encoding: str
+    ) -> Tuple[bytes, str, Dict[str, str]] | None:
+        """(body, its content encoding, stored headers), None on a miss"""
+        if not self.enabled:
+            return None
+        try:
+            body, encoded, headers = await DragonClient.get_client().hmget(
+                self._key(route, etag), [encoding, "encoded", "headers"]
+            )
+        except Exception:
+            metrics.inc("orm_response_cache_total", (("result", "error"),))
+            return None
+        if body is None:
+            metrics.inc("orm_response_cache_total", (("result", "miss"),))
+            return None
+        metrics.inc("orm_response_cache_total", (("result", "hit"),))
+        if encoding not in encoded.decode().split(","):
+            # small bodies are stored as is under every encoding
+            encoding = "identity"
+        return body, encoding, orjson.loads(headers)
+
+    async def fill(
+        self, route: str, etag: str, body: bytes, headers: Dict[str, str]
+    ) -> None:
+        """Stores body and its compressed variants, meant to run after the response"""
+        if not self.enabled or len(body) > self.max_body_size:
+            return
+        key = self._key(route, etag)
+        try:
+            cache = DragonClient.get_client()
+            if await cache.exists(key):
+                return
+            variants = await to_thread(self._variants, body)
+            encoded = [e for e, variant in variants.items() if variant is not body]
+            async with cache.pipeline(transaction=False) as pipe:
+                pipe.hset(
+                    key,
+                    mapping={
+                        "identity": body,
+                        **variants,
+                        "encoded": ",".join(encoded),
+                        "headers": orjson.dumps(headers),
+                    },
+                )
+                pipe.expire(key, self.ttl)
+                await pipe.execute()
+        except Exception:
+            pass
+
+    def _variants(self, body: bytes) -> Dict[str, bytes]:
+        """encoding -> compressed body, or body itself when compression doesn't pay"""
+        variants = dict.fromkeys(self.encodings, body)
+        if len(body) < self.min_compress_size:
+            return variants
+        for encoding in self.encodings:
+            if encoding == "br":
+                compressed = brotli.compress(body, quality=_BROTLI_QUALITY)
+            else:
+                compressed = gzip.compress(body, compresslevel=_GZIP_LEVEL, mtime=0)
+            if len(compressed) <= len(body) * _MAX_COMPRESS_RATIO:
+                variants[encoding] = compressed
+        return variants
+
+    def _key(self, route: str, etag: str) -> str:
+        digest = etag.strip('"')
+        return f"{self.prefix}response:{route}:{digest}"
@@ -1,33 +1,417 @@
 from asyncio import (
     create_task as asyncio_create_task,
+    gather as asyncio_gather,
     wait as asyncio_wait,
+    timeout_at as asyncio_timeout_at,
+    CancelledError,
+    Task,
     FIRST_COMPLETED as ASYNCIO_FIRST_COMPLETED,
     ALL_COMPLETED as ASYNCIO_ALL_COMPLETED,
 )
-from typing import List, Dict, Any, Type
-from pydantic import BaseModel
-from models.Document import Document
-from models.DataManager import DataManager
+from typing import (
+    List,
+    Dict,
+    Any,
+    Type,
+    Tuple,
+    Set,
+    Iterable,
+    Coroutine,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    TypeVar,
+)
+from functools import lru_cache
+from hashlib import blake2b
+from time import perf_counter, time
+import logging
+from pydantic import BaseModel, PrivateAttr, TypeAdapter, ValidationError
+from models.Document import (
+    Document,
+    partial_model,
+    construct_trusted,
+    construct_trusted_many,
+)
+from models.DataManager import (
+    DataManager,
+    CacheManager,
+    DocumentCacheManager,
+    BatchCacheManager,
+    BulkManager,
+    BulkUpdateManager,
+    CountManager,
+    CountCacheManager,
+    StreamingManager,
+    PrefixIndexManager,
+    PrefixSearchManager,
+    VersionManager,
+    FindOptions,
+    BadArgs,
+    CreateFail,
+    ReadFail,
+)
+from models.SingleFlight import SingleFlight
+from models.WriteBatcher import WriteBatcher
+from models.Routing import (
+    CircuitOpen,
+    Router,
+    current_deadline,
+    deadline,
+    detached_context,
+)
+from helpers.query_keys import freeze_query, serialize_query
+from helpers.metrics import metrics
+
+R = TypeVar("R")
+logger = logging.getLogger(__name__)
+# error code of items failing model validation, Mongo's DocumentValidationFailure
+_VALIDATION_FAILED = 121
+
+# keeps references to fire-and-forget tasks so they are not garbage collected
+_background_tasks: Set[Task] = set()
+
+
+def _spawn(coro: Coroutine) -> Task:
+    # background work outlives the request, its deadline doesn't apply
+    task = asyncio_create_task(coro, context=detached_context())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+@lru_cache(maxsize=256)
+def _list_adapter(schema: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[schema])
+
+
+def _stores_validated(manager: Type[DataManager]) -> bool:
+    return getattr(manager, "_stores_validated", False)
+
+
+def _touches(update_data: Dict[str, Any], fields: Iterable[str]) -> bool:
+    """Whether an update document (plain or with $ operators) writes any of fields"""
+    if not update_data:
+        return False
+    written = {
+        key
+        for operator, value in update_data.items()
+        for key in (value if operator.startswith("$") else (operator,))
+    }
+    return not written.isdisjoint(fields)
+
+
+def _order_by_ids(result: List[BaseModel], ids: List[Any]) -> List[BaseModel]:
+    """New list of result in the order of ids"""
+    position = {str(document_id): i for i, document_id in enumerate(ids)}
+    return sorted(
+        result, key=lambda item: position.get(getattr(item, "id", None), len(ids))
+    )
 
 
 class CRUD(BaseModel):
-    """Problems with exception handilng in asyncio.wait"""
+    """Problems with exception handilng in asyncio.wait
+
+    read_through: cache managers are asked first (in data_managers order),
+    misses go to the source managers and fill the caches in background,
+    stale cache hits are served and revalidated in background
+
+    coalesce_reads: concurrent get calls with the same query share one
+    backend call (see single_flight.stats())
+
+    trust_storage: data read from the managers was validated when written,
+    build models with construct_trusted instead of validating them again
+
+    batch_writes: creates going to a bulk capable source and fills of batch
+    capable caches wait up to batch_window seconds (or batch_max items) and
+    are written together, see WriteBatcher
+
+    hedge_reads: managers are asked one after another, the next one starts
+    when the previous missed, failed or is slower than its usual latency
+    (see router.hedge_delay) instead of all of them at once
+
+    deadline: seconds every manager call of a get / create / update /
+    delete must finish in, managers with an open circuit (see Router) are
+    skipped without being called. Batched writes don't inherit the deadline
+    of the caller that opened the batch: a flush of fills gets its own, a
+    flush of creates one for the insert and one for the cache side effects
+
+    etag_settle: seconds after a write during which etag() gives None,
+    caches of other workers (L1 before its invalidation arrives) and reads
+    that started before the write may still serve what it changed
+    """
 
     data_managers: List[Type[DataManager]]
     model: Type[Document]
     response_schema: Type[BaseModel] | None = None
+    read_through: bool = False
+    coalesce_reads: bool = False
+    trust_storage: bool = False
+    batch_writes: bool = False
+    batch_window: float = 0.002
+    batch_max: int = 500
+    hedge_reads: bool = False
+    deadline: float | None = None
+    etag_settle: float = 5.0
+    _single_flight: SingleFlight = PrivateAttr(default_factory=SingleFlight)
+    _batchers: Dict[str, WriteBatcher] = PrivateAttr(default_factory=dict)
+    _router: Router = PrivateAttr(default_factory=Router)
+
+    @property
+    def single_flight(self) -> SingleFlight:
+        return self._single_flight
+
+    @property
+    def batchers(self) -> Dict[str, WriteBatcher]:
+        return self._batchers
+
+    @property
+    def router(self) -> Router:
+        return self._router
 
     async def get(
         self,
         query: BaseModel,
     ) -> List[BaseModel] | BaseModel | None:
         valid_query = await self.model.get_find_query(query)
-        tasks = [
+        options = await self.model.get_find_options(query)
+        with deadline(self.deadline):
+            if self.coalesce_reads:
+                result = await self._single_flight.do(
+                    freeze_query(valid_query, options),
+                    lambda: self._get(valid_query, options),
+                )
+            else:
+                result = await self._get(valid_query, options)
+        # equivalent id lookups share cache entries and flights, not the order
+        ids = await self.model.get_lookup_ids(valid_query, options)
+        if ids is not None and isinstance(result, List):
+            return _order_by_ids(result, ids)
+        return result
+
+    async def count(
+        self,
+        query: BaseModel,
+    ) -> int | None:
+        """Documents matching query, from a briefly cached count when there is one
+
+        None when no manager could count.
+        """
+        valid_query = await self.model.get_find_query(query)
+        with deadline(self.deadline):
+            if self.coalesce_reads:
+                return await self._single_flight.do(
+                    ("count", freeze_query(valid_query)),
+                    lambda: self._count(valid_query),
+                )
+            return await self._count(valid_query)
+
+    async def etag(
+        self,
+        query: BaseModel,
+    ) -> str | None:
+        """Strong ETag of the result of get(query), None when it can't be told
+
+        Derived from the canonical query and options (and the order of the
+        ids of _id lookups) and the version kept by the first VersionManager,
+        of the documents for _id lookups and of the collection otherwise. Read it before the result, a write landing
+        in between only makes the next request miss.
+        """
+        managers = [m for m in self.data_managers if isinstance(m, VersionManager)]
+        if not managers:
+            return None
+        valid_query = await self.model.get_find_query(query)
+        options = await self.model.get_find_options(query)
+        ids = await self.model.get_lookup_ids(valid_query, options)
+        with deadline(self.deadline):
+            if self.coalesce_reads:
+                key = None if ids is None else tuple(str(i) for i in ids)
+                found = await self._single_flight.do(
+                    ("version", key), lambda: self._version(managers, ids)
+                )
+            else:
+                found = await self._version(managers, ids)
+        if found is None:
+            return None
+        version, written = found
+        if time() - written < self.etag_settle:
+            return None
+        key = f"{version}|{serialize_query(valid_query, options)}"
+        if ids is not None:
+            # the canonical query sorts $in, get() returns ids in the asked order
+            key += "|" + ",".join(str(i) for i in ids)
+        return f'"{blake2b(key.encode(), digest_size=16).hexdigest()}"'
+
+    async def _version(
+        self,
+        managers: List[Type[VersionManager]],
+        ids: List[Any] | None,
+    ) -> Tuple[str, float] | None:
+        for manager in managers:
+            try:
+                return await self._call(
+                    "get_version", manager, lambda: manager.get_version(ids)
+                )
+            except Exception:
+                continue
+        return None
+
+    async def _bump_versions(self, ids: List[Any] | None) -> None:
+        """After a write reached its source and the caches, ids None when the
+        written documents aren't known"""
+        for manager in self.data_managers:
+            if not isinstance(manager, VersionManager):
+                continue
+            try:
+                await self._call(
+                    "bump_version", manager, lambda: manager.bump_version(ids)
+                )
+            except Exception:
+                pass
+
+    async def _count(self, valid_query: Dict[str, Any]) -> int | None:
+        caches, sources = self._split_managers()
+        caches = [c for c in caches if isinstance(c, CountCacheManager)]
+        for cache in caches:
+            try:
+                count = await self._call(
+                    "get_count", cache, lambda: cache.get_count(valid_query)
+                )
+            except Exception:
+                continue
+            metrics.cache_lookup(cache, "miss" if count is None else "hit")
+            if count is not None:
+                metrics.served(cache)
+                return count
+
+        for source in sources:
+            if not isinstance(source, CountManager):
+                continue
+            try:
+                count = await self._call(
+                    "count", source, lambda: source.count(valid_query)
+                )
+            except Exception:
+                continue
+            metrics.served(source)
+            _spawn(self._fill_counts(caches, valid_query, count))
+            return count
+        metrics.served(None)
+        return None
+
+    async def _fill_counts(
+        self,
+        caches: List[Type[CountCacheManager]],
+        query: Dict[str, Any],
+        count: int,
+    ) -> None:
+        for cache in caches:
+            try:
+                await self._call(
+                    "fill_count", cache, lambda: cache.fill_count(query, count)
+                )
+            except Exception:
+                pass
+
+    async def stream(
+        self,
+        query: BaseModel,
+    ) -> AsyncIterator[BaseModel]:
+        """Yields validated documents from the first streaming source, bypassing caches"""
+        valid_query = await self.model.get_find_query(query)
+        options = await self.model.get_find_options(query)
+        for manager in self.data_managers:
+            if isinstance(manager, StreamingManager):
+                schema = self.get_response_schema(options)
+                async for item in manager.iterate(query=valid_query, options=options):
+                    yield self.validate_response(item, schema)
+                return
+
+    async def drain(self, timeout: float | None = None) -> None:
+        """Flushes queued batched writes and waits for background cache work
+
+        For shutdown, after the last request finished.
+        """
+        for batcher in list(self._batchers.values()):
+            await batcher.flush()
+        if _background_tasks:
+            await asyncio_wait(set(_background_tasks), timeout=timeout)
+        # fills spawned by the background work just awaited
+        for batcher in list(self._batchers.values()):
+            await batcher.flush()
+
+    async def search(
+        self,
+        field: str,
+        prefix: str,
+        limit: int,
+    ) -> List[BaseModel]:
+        """Up to limit documents whose field starts with prefix, ignoring case
+
+        Results hold _id and field only. They come from the first built
+        prefix index (see PrefixIndexManager), from a prefix searching source
+        otherwise, which also starts a rebuild of the unbuilt indexes.
+        """
+        if field not in self.model._prefix_fields:
+            raise BadArgs(details=f"{field} is not prefix searchable")
+        options = FindOptions(limit=limit, fields=["_id", field])
+        caches, sources = self._split_managers()
+        unbuilt = []
+        with deadline(self.deadline):
+            for cache in caches:
+                if not isinstance(cache, PrefixIndexManager):
+                    continue
+                try:
+                    found = await self._call(
+                        "search_prefix",
+                        cache,
+                        lambda: cache.search_prefix(field, prefix, limit),
+                    )
+                except Exception:
+                    continue
+                if found is None:
+                    unbuilt.append(cache)
+                    continue
+                metrics.served(cache)
+                return self._try_validate_data(found, options) or []
+
+            for cache in unbuilt:
+                _spawn(self._rebuild_prefix_index(cache, field))
+            for source in sources:
+                if not isinstance(source, PrefixSearchManager):
+                    continue
+                try:
+                    found = await self._call(
+                        "find_prefix",
+                        source,
+                        lambda: source.find_prefix(field, prefix, limit),
+                    )
+                except Exception:
+                    continue
+                metrics.served(source)
+                return self._try_validate_data(found, options) or []
+        metrics.served(None)
+        return []
+
+    async def _get(
+        self,
+        valid_query: Dict[str, Any],
+        options: FindOptions | None,
+    ) -> List[BaseModel] | BaseModel | None:
+        if self.read_through:
+            return await self._read_through(valid_query, options)
+        if self.hedge_reads:
+            return await self._hedged_get(valid_query, options)
+
+        managers = {
             asyncio_create_task(
-                self._get_by_manager(manager=manager, query=valid_query)
-            )
+                self._get_by_manager(
+                    manager=manager, query=valid_query, options=options
+                )
+            ): manager
             for manager in self.data_managers
-        ]
+        }
+        tasks = set(managers)
 
         while True:
             done, pending = await asyncio_wait(
@@ -39,9 +423,11 @@ class CRUD(BaseModel):
                 if result is not None:
                     for t in pending:
                         t.cancel()
+                    metrics.served(managers[task])
                     return result
 
             if not pending:
+                metrics.served(None)
                 return None
 
             tasks = pending
@@ -49,8 +435,20 @@ class CRUD(BaseModel):
     async def create(
         self,
         create_data: BaseModel,
+    ) -> List[BaseModel] | BaseModel | None:
+        with deadline(self.deadline):
+            return await self._create(create_data)
+
+    async def _create(
+        self,
+        create_data: BaseModel,
     ) -> List[BaseModel] | BaseModel | None:
         valid_create_data = await self.model.get_create_data(create_data)
+        caches, sources = self._split_managers()
+        if self.batch_writes and valid_create_data:
+            for manager in sources:
+                if isinstance(manager, BulkManager):
+                    return await self._create_batched(manager, valid_create_data)
 
         tasks = [
             asyncio_create_task(
@@ -59,9 +457,9 @@ class CRUD(BaseModel):
                     create_data=valid_create_data,
                 )
             )
-            for manager in self.data_managers
+            for manager in sources
         ]
-        while True:
+        while tasks:
             done, pending = await asyncio_wait(
                 tasks, return_when=ASYNCIO_FIRST_COMPLETED
             )
@@ -69,12 +467,150 @@ class CRUD(BaseModel):
             for task in done:
                 result = task.result()
                 if result is not None and len(result) > 0:
+                    # caches are invalidated after the source write so that
+                    # a concurrent read can't fill them with pre-write data
+                    await self._run_all(
+                        self._create_by_manager(
+                            manager=manager, create_data=valid_create_data
+                        )
+                        for manager in caches
+                    )
+                    await self._index_prefixes(result)
+                    await self._bump_versions([item.id for item in result])
                     return result
 
-            if not pending:
-                return None
-
             tasks = pending
+        return None
+
+    async def bulk_create(
+        self,
+        create_data: List[BaseModel],
+    ) -> Tuple[List[BaseModel], List[Dict[str, Any]]]:
+        """Inserts through the first bulk capable source, returns (created, errors)
+
+        errors: {"index", "code", "message"} per failed item of create_data
+        """
+        valid_create_data: List[Dict[str, Any]] = []
+        # index in create_data of every document of valid_create_data
+        positions: List[int] = []
+        errors: List[Dict[str, Any]] = []
+        for index, item in enumerate(create_data):
+            try:
+                documents = await self.model.get_create_data(item)
+            except ValidationError as e:
+                errors.append(
+                    {
+                        "index": index,
+                        "code": _VALIDATION_FAILED,
+                        "message": "; ".join(
+                            f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                            for error in e.errors()
+                        ),
+                    }
+                )
+                continue
+            valid_create_data += documents
+            positions += [index] * len(documents)
+
+        _, sources = self._split_managers()
+        for manager in sources:
+            if isinstance(manager, BulkManager):
+                if not valid_create_data:
+                    return [], errors
+                inserted, storage_errors = await self._bulk_create_by_manager(
+                    manager, valid_create_data
+                )
+                errors += [
+                    {**error, "index": positions[error["index"]]}
+                    for error in storage_errors
+                ]
+                errors.sort(key=lambda error: error["index"])
+                return self.validate_many(inserted), errors
+        raise BadArgs(details="No data manager supports bulk create")
+
+    async def _bulk_create_by_manager(
+        self,
+        manager: Type[BulkManager],
+        create_data: List[Dict[str, Any]],
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """bulk_create of manager, then invalidation of the caches"""
+        with deadline(self.deadline):
+            inserted, errors = await self._call(
+                "bulk_create", manager, lambda: manager.bulk_create(create_data)
+            )
+        await self._after_create(inserted)
+        return inserted, errors
+
+    async def _after_create(self, inserted: List[Dict[str, Any]]) -> None:
+        """Cache invalidation, prefix indexing and version bumps of inserted
+        documents, under a deadline of their own, failures don't undo the insert
+        """
+        if not inserted:
+            return
+        caches, _ = self._split_managers()
+        try:
+            with deadline(self.deadline):
+                await self._run_all(
+                    self._create_by_manager(manager=cache, create_data=inserted)
+                    for cache in caches
+                )
+                await self._index_prefixes(inserted)
+                await self._bump_versions([document["_id"] for document in inserted])
+        except Exception:
+            logger.warning("after create of %s failed", len(inserted), exc_info=True)
+
+    async def _create_batched(
+        self,
+        manager: Type[BulkManager],
+        create_data: List[Dict[str, Any]],
+    ) -> List[BaseModel] | None:
+        batcher = self._get_batcher(f"create:{manager.__name__}", manager)
+        try:
+            inserted = await asyncio_gather(
+                *(batcher.submit(document) for document in create_data)
+            )
+        except Exception:
+            return None
+        return self.validate_many(list(inserted))
+
+    def _get_batcher(self, name: str, manager: Type[DataManager]) -> WriteBatcher:
+        batcher = self._batchers.get(name)
+        if batcher is not None:
+            return batcher
+
+        # the whole flush of fills is bounded, creates bound the insert and
+        # its side effects separately (see _bulk_create_by_manager)
+        timeout = None
+        if isinstance(manager, BatchCacheManager):
+            timeout = self.deadline
+
+            async def flush(fills: List[Tuple]) -> List[Any]:
+                await manager.fill_many(fills)
+                return [True] * len(fills)
+
+        else:
+
+            async def flush(documents: List[Dict[str, Any]]) -> List[Any]:
+                inserted, errors = await self._bulk_create_by_manager(
+                    manager, documents
+                )
+                storage = manager._get_data_storage()
+                failed = {
+                    error["index"]: CreateFail(
+                        data_storage=storage, details=error["message"]
+                    )
+                    for error in errors
+                }
+                return [failed.get(i, doc) for i, doc in enumerate(documents)]
+
+        batcher = self._batchers[name] = WriteBatcher(
+            flush,
+            name=name,
+            window=self.batch_window,
+            max_batch=self.batch_max,
+            timeout=timeout,
+        )
+        return batcher
 
     async def update(
         self,
@@ -84,64 +620,586 @@ class CRUD(BaseModel):
     ) -> bool:
         valid_query = await self.model.get_find_query(query)
         valid_update_data = await self.model.get_update_data(update_data)
-        tasks = [
-            asyncio_create_task(
-                self._update_by_manager(
-                    manager=manager, query=valid_query, update_data=valid_update_data
+        caches, sources = self._split_managers()
+        with deadline(self.deadline):
+            reindexed = None
+            if _touches(valid_update_data, self.model._prefix_fields):
+                reindexed = await self._written_ids(valid_query)
+            # the result is the sources', a failed cache is only logged
+            res, _ = [
+                await self._run_all(
+                    self._update_by_manager(
+                        manager=manager,
+                        query=valid_query,
+                        update_data=valid_update_data,
+                    )
+                    for manager in managers
                 )
+                for managers in (sources, caches)
+            ]
+            if reindexed:
+                await self._reindex_prefixes(reindexed)
+            await self._bump_versions(
+                reindexed
+                if reindexed is not None
+                else await self.model.get_lookup_ids(valid_query)
             )
-            for manager in self.data_managers
+        return all(res)
+
+    async def bulk_update(
+        self,
+        updates: List[Tuple[BaseModel, BaseModel]],
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """Applies (query, update data) pairs through the first bulk update
+        capable source, returns (matched documents, errors)
+
+        The source gets one bulk_write, every cache one eviction of what
+        the operations may change. Nothing is read before the write when
+        the queries name their _ids. errors: {"index", "code", "message"}
+        per failed item of updates.
+        """
+        operations = [
+            (
+                await self.model.get_find_query(query),
+                await self.model.get_update_data(update_data),
+            )
+            for query, update_data in updates
         ]
+        caches, sources = self._split_managers()
+        source = next((m for m in sources if isinstance(m, BulkUpdateManager)), None)
+        if source is None:
+            raise BadArgs(details="No data manager supports bulk update")
 
-        done, pending = await asyncio_wait(tasks, return_when=ASYNCIO_ALL_COMPLETED)
-        res: List[bool] = []
-        for task in done:
-            result = task.result()
-            res.append(result)
-        return all(res)
+        reindexed = []
+        written: List[Any] = []
+        # some query doesn't name its _ids, written can't tell what changed
+        unknown = False
+        for query, update_data in operations:
+            if _touches(update_data, self.model._prefix_fields):
+                reindexed += await self._written_ids(query) or []
+            if unknown:
+                continue
+            ids = await self.model.get_lookup_ids(query)
+            if ids is None:
+                unknown = True
+            else:
+                written.extend(ids)
+        matched, errors = await self._call(
+            "bulk_update", source, lambda: source.bulk_update(operations)
+        )
+        await self._run_all(
+            self._bulk_update_by_manager(cache, operations) for cache in caches
+        )
+        if reindexed:
+            await self._reindex_prefixes(reindexed)
+        await self._bump_versions(None if unknown else written)
+        return matched, errors
 
     async def delete(
         self,
         query: BaseModel,
     ) -> bool:
         valid_query = await self.model.get_find_query(query)
-        tasks = [
-            asyncio_create_task(
-                self._delete_by_manager(manager=manager, query=valid_query)
+        caches, sources = self._split_managers()
+        with deadline(self.deadline):
+            reindexed = None
+            if self.model._prefix_fields:
+                reindexed = await self._written_ids(valid_query)
+            # the result is the sources', a failed cache is only logged
+            res, _ = [
+                await self._run_all(
+                    self._delete_by_manager(manager=manager, query=valid_query)
+                    for manager in managers
+                )
+                for managers in (sources, caches)
+            ]
+            if reindexed:
+                await self._reindex_prefixes(reindexed)
+            await self._bump_versions(
+                reindexed
+                if reindexed is not None
+                else await self.model.get_lookup_ids(valid_query)
             )
-            for manager in self.data_managers
+        return all(res)
+
+    async def _run_all(self, coros: Iterable[Coroutine]) -> List[Any]:
+        tasks = [asyncio_create_task(coro) for coro in coros]
+        if not tasks:
+            return []
+        await asyncio_wait(tasks, return_when=ASYNCIO_ALL_COMPLETED)
+        return [task.result() for task in tasks]
+
+    async def _hedged_get(
+        self,
+        query: Dict[str, Any],
+        options: FindOptions | None,
+    ) -> List[BaseModel] | BaseModel | None:
+        """Managers in data_managers order, the next one starts when every running
+        one missed or failed, or the last started one is past its hedge delay"""
+        running: Dict[Task, Type[DataManager]] = {}
+        pending = list(self.data_managers)
+        try:
+            while pending or running:
+                timeout = None
+                if pending:
+                    manager = pending.pop(0)
+                    task = asyncio_create_task(
+                        self._get_by_manager(
+                            manager=manager, query=query, options=options
+                        )
+                    )
+                    running[task] = manager
+                    if pending:
+                        timeout = self._router.hedge_delay(manager)
+                while running:
+                    done, _ = await asyncio_wait(
+                        running, timeout=timeout, return_when=ASYNCIO_FIRST_COMPLETED
+                    )
+                    if not done:
+                        metrics.inc("orm_hedged_reads_total", ())
+                        break
+                    for task in done:
+                        manager = running.pop(task)
+                        if (result := task.result()) is not None:
+                            metrics.served(manager)
+                            return result
+            metrics.served(None)
+            return None
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def _read_through(
+        self,
+        query: Dict[str, Any],
+        options: FindOptions | None,
+    ) -> List[BaseModel] | BaseModel | None:
+        caches, sources = self._split_managers()
+        ids = await self.model.get_lookup_ids(query, options)
+        # fills of what this read finds are dropped if a write invalidates them after
+        since = time()
+        # sources read started early because a cache was slow (hedge_reads)
+        source_read: Task | None = None
+        try:
+            for tier, cache in enumerate(caches):
+                if ids is not None and isinstance(cache, DocumentCacheManager):
+                    result = await self._read_documents(cache, sources, ids, since)
+                    if tier and result is not None:
+                        _spawn(
+                            self._fill(
+                                caches[:tier], query, options, None, result, since
+                            )
+                        )
+                    return result
+
+                lookup = asyncio_create_task(
+                    self._get_entry_by_manager(
+                        manager=cache, query=query, options=options
+                    )
+                )
+                if self.hedge_reads and source_read is None:
+                    done, _ = await asyncio_wait(
+                        {lookup}, timeout=self._router.hedge_delay(cache)
+                    )
+                    if not done:
+                        metrics.inc("orm_hedged_reads_total", ())
+                        source_read = asyncio_create_task(
+                            self._read_sources(sources, query, options)
+                        )
+                        done, _ = await asyncio_wait(
+                            {lookup, source_read},
+                            return_when=ASYNCIO_FIRST_COMPLETED,
+                        )
+                        if lookup not in done and source_read.result() is not None:
+                            lookup.cancel()
+                            metrics.cache_lookup(cache, "miss")
+                            return self._from_source(
+                                caches, query, options, source_read, since
+                            )
+
+                data, stale = await lookup
+                if (
+                    data
+                    and (result := self._try_validate_data(data, options)) is not None
+                ):
+                    metrics.cache_lookup(cache, "stale" if stale else "hit")
+                    metrics.served(cache)
+                    if stale:
+                        _spawn(self._revalidate(cache, query, options))
+                    if tier:
+                        raw = None if _stores_validated(cache) else data
+                        _spawn(
+                            self._fill(
+                                caches[:tier], query, options, raw, result, since
+                            )
+                        )
+                    return result
+                metrics.cache_lookup(cache, "miss")
+
+            if source_read is None:
+                source_read = asyncio_create_task(
+                    self._read_sources(sources, query, options)
+                )
+            await source_read
+            return self._from_source(caches, query, options, source_read, since)
+        finally:
+            if source_read is not None and not source_read.done():
+                source_read.cancel()
+
+    async def _read_sources(
+        self,
+        sources: List[Type[DataManager]],
+        query: Dict[str, Any],
+        options: FindOptions | None,
+    ) -> Tuple[Type[DataManager], List[Dict[str, Any]], Any] | None:
+        """(source, data, validated result) of the first source with a result"""
+        for source in sources:
+            data = await self._get_raw_by_manager(
+                manager=source, query=query, options=options
+            )
+            if data and (result := self._try_validate_data(data, options)) is not None:
+                return source, data, result
+        return None
+
+    def _from_source(
+        self,
+        caches: List[Type[CacheManager]],
+        query: Dict[str, Any],
+        options: FindOptions | None,
+        source_read: Task,
+        since: float,
+    ) -> List[BaseModel] | BaseModel | None:
+        found = source_read.result()
+        if found is None:
+            metrics.served(None)
+            return None
+        source, data, result = found
+        metrics.served(source)
+        _spawn(self._fill(caches, query, options, data, result, since))
+        return result
+
+    async def _read_documents(
+        self,
+        cache: Type[DocumentCacheManager],
+        sources: List[Type[DataManager]],
+        ids: List[Any],
+        since: float,
+    ) -> List[BaseModel] | None:
+        """Cached documents plus one $in find of the missing ids, in the order of ids
+
+        Raises ReadFail when ids are missing and no source answered.
+        """
+        try:
+            found = await self._call(
+                "get_documents", cache, lambda: cache.get_documents(ids)
+            )
+        except Exception:
+            found = {}
+        missing = [i for i in ids if str(i) not in found]
+        metrics.cache_lookup(
+            cache, "miss" if not found else "partial" if missing else "hit"
+        )
+
+        if missing:
+            for source in sources:
+                fetched = await self._get_raw_by_manager(
+                    manager=source, query={"_id": {"$in": missing}}
+                )
+                if fetched is not None:
+                    metrics.served(source)
+                    if fetched:
+                        found.update((str(d["_id"]), d) for d in fetched)
+                        _spawn(self._fill_documents(cache, fetched, since))
+                    break
+            else:
+                # the cached ones alone would pass for a complete result
+                metrics.served(None)
+                raise ReadFail(details="No source answered for uncached ids")
+        else:
+            metrics.served(cache)
+
+        documents = [found[str(i)] for i in ids if str(i) in found]
+        if not documents:
+            return None
+        return self._try_validate_data(documents)
+
+    async def _fill_documents(
+        self,
+        cache: Type[DocumentCacheManager],
+        documents: List[Dict[str, Any]],
+        since: float,
+    ) -> None:
+        try:
+            await self._call(
+                "fill_documents",
+                cache,
+                lambda: cache.fill_documents(documents, since=since),
+            )
+        except Exception:
+            pass
+
+    async def _revalidate(
+        self,
+        stale_cache: Type[CacheManager],
+        query: Dict[str, Any],
+        options: FindOptions | None,
+    ) -> None:
+        caches, sources = self._split_managers()
+        since = time()
+        try:
+            if not await self._call(
+                "lock_refresh",
+                stale_cache,
+                lambda: stale_cache.lock_refresh(query=query, options=options),
+            ):
+                return
+        except Exception:
+            return
+        if found := await self._read_sources(sources, query, options):
+            _, data, result = found
+            await self._fill(caches, query, options, data, result, since)
+
+    async def _fill(
+        self,
+        caches: List[Type[CacheManager]],
+        query: Dict[str, Any],
+        options: FindOptions | None,
+        data: List[Dict[str, Any]] | None,
+        result: List[BaseModel] | BaseModel,
+        since: float,
+    ) -> None:
+        """Validated caches get the result, the others raw data when there is any
+
+        since: time() the read of data started, caches drop the fill when a
+        write invalidated it after that
+        """
+        for cache in caches:
+            if _stores_validated(cache):
+                fill_data = result if isinstance(result, List) else [result]
+            elif data is not None:
+                fill_data = data
+            else:
+                continue
+            try:
+                if self.batch_writes and isinstance(cache, BatchCacheManager):
+                    batcher = self._get_batcher(f"fill:{cache.__name__}", cache)
+                    await self._call(
+                        "fill",
+                        cache,
+                        lambda: batcher.submit((query, fill_data, options, since)),
+                    )
+                else:
+                    await self._call(
+                        "fill",
+                        cache,
+                        lambda: cache.fill(
+                            query=query, data=fill_data, options=options, since=since
+                        ),
+                    )
+            except Exception:
+                pass
+
+    def _prefix_indexes(self) -> List[Type[PrefixIndexManager]]:
+        if not self.model._prefix_fields:
+            return []
+        return [m for m in self.data_managers if isinstance(m, PrefixIndexManager)]
+
+    async def _index_prefixes(
+        self, documents: List[Dict[str, Any]] | List[BaseModel]
+    ) -> None:
+        """Adds created documents to the prefix indexes before the create returns"""
+        if not (indexes := self._prefix_indexes()):
+            return
+        keys = {"id", "_id", *self.model._prefix_fields}
+        documents = [
+            (
+                document.model_dump(by_alias=True, include=keys)
+                if isinstance(document, BaseModel)
+                else {key: document[key] for key in keys if key in document}
+            )
+            for document in documents
         ]
+        await self._run_all(self._update_index(index, documents) for index in indexes)
 
-        done, pending = await asyncio_wait(tasks, return_when=ASYNCIO_ALL_COMPLETED)
-        res: List[bool] = []
-        for task in done:
-            result = task.result()
-            res.append(result)
-        return all(res)
+    async def _written_ids(self, query: Dict[str, Any]) -> List[Any] | None:
+        """_ids of the documents an update or delete of query writes, read from
+        a source before the write unless the query names them, None without
+        prefix indexes"""
+        if not self._prefix_indexes():
+            return None
+        if (ids := await self.model.get_lookup_ids(query)) is not None:
+            return ids
+        _, sources = self._split_managers()
+        for source in sources:
+            found = await self._get_raw_by_manager(
+                manager=source, query=query, options=FindOptions(fields=["_id"])
+            )
+            if found is not None:
+                return [document["_id"] for document in found]
+        return None
+
+    async def _reindex_prefixes(self, ids: List[Any]) -> None:
+        """Indexes the current values of documents ids, unindexes the deleted ones"""
+        _, sources = self._split_managers()
+        options = FindOptions(fields=["_id", *self.model._prefix_fields])
+        for source in sources:
+            found = await self._get_raw_by_manager(
+                manager=source, query={"_id": {"$in": ids}}, options=options
+            )
+            if found is not None:
+                break
+        else:
+            return
+        present = {str(document["_id"]) for document in found}
+        deleted = [i for i in ids if str(i) not in present]
+        for index in self._prefix_indexes():
+            await self._update_index(index, found, deleted)
+
+    async def _update_index(
+        self,
+        index: Type[PrefixIndexManager],
+        documents: List[Dict[str, Any]],
+        deleted: List[Any] | None = None,
+    ) -> None:
+        try:
+            if documents:
+                await self._call(
+                    "index_prefixes", index, lambda: index.index_prefixes(documents)
+                )
+            if deleted:
+                await self._call(
+                    "unindex_prefixes", index, lambda: index.unindex_prefixes(deleted)
+                )
+        except Exception:
+            pass
+
+    async def _rebuild_prefix_index(
+        self, index: Type[PrefixIndexManager], field: str
+    ) -> None:
+        _, sources = self._split_managers()
+        for source in sources:
+            if isinstance(source, StreamingManager):
+                documents = source.iterate(
+                    query={}, options=FindOptions(fields=["_id", field])
+                )
+                # not through _call, the router would take it for a slow read
+                try:
+                    await index.rebuild_prefix_index(field, documents)
+                except Exception:
+                    pass
+                return
+
+    def _split_managers(
+        self,
+    ) -> Tuple[List[Type[CacheManager]], List[Type[DataManager]]]:
+        caches = [m for m in self.data_managers if isinstance(m, CacheManager)]
+        sources = [m for m in self.data_managers if not isinstance(m, CacheManager)]
+        return caches, sources
+
+    async def _call(
+        self,
+        operation: str,
+        manager: Type[DataManager],
+        call: Callable[[], Awaitable[R]],
+    ) -> R:
+        """One manager call under its circuit breaker and the request deadline
+
+        Raises CircuitOpen without calling while the breaker of manager is
+        open, latency and errors go to the router and metrics.
+        """
+        if not self._router.allow(manager):
+            metrics.inc("orm_circuit_skips_total", (("manager", manager.__name__),))
+            raise CircuitOpen(
+                data_storage=manager._get_data_storage(), details="Circuit open"
+            )
+        started = perf_counter()
+        try:
+            if (at := current_deadline()) is None:
+                result = await call()
+            else:
+                async with asyncio_timeout_at(at):
+                    result = await call()
+        except CancelledError:
+            self._router.cancelled(manager)
+            raise
+        except Exception as e:
+            self._router.record(manager, perf_counter() - started, e)
+            metrics.manager_call(operation, manager, started, e)
+            raise
+        self._router.record(manager, perf_counter() - started)
+        metrics.manager_call(operation, manager, started)
+        return result
 
     async def _get_by_manager(
-        self, *, manager: type[DataManager], query: Dict[str, Any]
+        self,
+        *,
+        manager: type[DataManager],
+        query: Dict[str, Any],
+        options: FindOptions | None = None,
     ) -> List[BaseModel] | BaseModel | None:
+        data = await self._get_raw_by_manager(
+            manager=manager, query=query, options=options
+        )
+        if metrics.enabled and isinstance(manager, CacheManager):
+            metrics.cache_lookup(manager, "hit" if data else "miss")
+        if data:
+            return self._try_validate_data(data, options)
+        return None
+
+    async def _get_raw_by_manager(
+        self,
+        *,
+        manager: type[DataManager],
+        query: Dict[str, Any],
+        options: FindOptions | None = None,
+    ) -> List[Dict[str, Any]] | Dict[str, Any] | None:
         try:
-            data = await manager.get(query=query)
-            if data:
-                if isinstance(data, List):
-                    return [self.validate_response(item) for item in data]
-                return self.validate_response(data)
+            return await self._call(
+                "get", manager, lambda: manager.get(query=query, options=options)
+            )
+        except Exception:
             return None
 
+    async def _get_entry_by_manager(
+        self,
+        *,
+        manager: Type[CacheManager],
+        query: Dict[str, Any],
+        options: FindOptions | None = None,
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        try:
+            return await self._call(
+                "get_entry",
+                manager,
+                lambda: manager.get_entry(query=query, options=options),
+            )
         except Exception:
+            return [], False
+
+    def _try_validate_data(
+        self,
+        data: List[Dict[str, Any]] | Dict[str, Any],
+        options: FindOptions | None = None,
+    ) -> List[BaseModel] | BaseModel | None:
+        schema = self.get_response_schema(options)
+        try:
+            if isinstance(data, List):
+                return self.validate_many(data, schema)
+            return self.validate_response(data, schema)
+        except Exception:
+            metrics.inc("orm_validation_errors_total", (("schema", schema.__name__),))
             return None
 
     async def _create_by_manager(
         self, manager: Type[DataManager], create_data: List[Dict[str, Any]]
     ) -> List[BaseModel]:
         try:
-            data = await manager.create(create_data)
+            data = await self._call(
+                "create", manager, lambda: manager.create(create_data)
+            )
             if data:
                 if isinstance(data, List):
-                    ld = [self.validate_response(item) for item in data]
-                    return ld
+                    return self.validate_many(data)
                 else:
                     return [self.validate_response(data)]
             return []
@@ -157,11 +1215,33 @@ class CRUD(BaseModel):
         update_data: Dict[str, Any],
     ) -> bool:
         try:
-            return await manager.update(query=query, update_data=update_data)
-
+            return await self._call(
+                "update",
+                manager,
+                lambda: manager.update(query=query, update_data=update_data),
+            )
         except Exception:
+            logger.warning("update through %s failed", manager.__name__, exc_info=True)
             return False
 
+    async def _bulk_update_by_manager(
+        self,
+        manager: Type[DataManager],
+        operations: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+    ) -> None:
+        if not isinstance(manager, BulkUpdateManager):
+            await self._run_all(
+                self._update_by_manager(manager, query, update_data)
+                for query, update_data in operations
+            )
+            return
+        try:
+            await self._call(
+                "bulk_update", manager, lambda: manager.bulk_update(operations)
+            )
+        except Exception:
+            pass
+
     async def _delete_by_manager(
         self,
         *,
@@ -169,12 +1249,51 @@ class CRUD(BaseModel):
         query: Dict[str, Any],
     ) -> bool:
         try:
-            return await manager.delete(query=query)
-
+            return await self._call(
+                "delete", manager, lambda: manager.delete(query=query)
+            )
         except Exception:
+            logger.warning("delete through %s failed", manager.__name__, exc_info=True)
             return False
 
-    def validate_response(self, item: Dict[str, Any]) -> BaseModel:
-        if self.response_schema:
-            return self.response_schema.model_validate(item)
-        return self.model.model_validate(item)
+    def get_response_schema(
+        self, options: FindOptions | None = None
+    ) -> Type[BaseModel]:
+        """response_schema (or model) narrowed to the projected fields"""
+        schema = self.response_schema or self.model
+        if options is not None and options.fields is not None:
+            return partial_model(schema, frozenset(options.fields))
+        return schema
+
+    def validate_response(
+        self,
+        item: Dict[str, Any] | BaseModel,
+        schema: Type[BaseModel] | None = None,
+    ) -> BaseModel:
+        schema = schema or self.response_schema or self.model
+        if isinstance(item, schema):
+            return item
+        if self.trust_storage:
+            return construct_trusted(schema, item)
+        return schema.model_validate(item)
+
+    def validate_many(
+        self,
+        items: List[Dict[str, Any] | BaseModel],
+        schema: Type[BaseModel] | None = None,
+    ) -> List[BaseModel]:
+        """One validator call for the whole list instead of one per item"""
+        schema = schema or self.response_schema or self.model
+        if all(isinstance(item, schema) for item in items):
+            return items
+        if self.trust_storage:
+            return construct_trusted_many(schema, items)
+        return _list_adapter(schema).validate_python(items)
+
+    def encode_response(self, result: List[BaseModel] | BaseModel) -> bytes:
+        """JSON body (by alias) straight from pydantic-core, skipping jsonable_encoder"""
+        if isinstance(result, List):
+            if not result:
+                return b"[]"
+            return _list_adapter(type(result[0])).dump_json(result, by_alias=True)
+        return result.model_dump_json(by_alias=True).encode()
@@ -1,4 +1,15 @@
-from typing import Protocol, Dict, Any, TypeVar, List, Callable, Awaitable
+from typing import (
+    Protocol,
+    Dict,
+    Any,
+    TypeVar,
+    List,
+    Tuple,
+    Callable,
+    Awaitable,
+    AsyncIterator,
+)
+from pydantic import BaseModel
 from models.Document import Document
 from bson import ObjectId
 from abc import abstractmethod
@@ -47,6 +58,20 @@ class BadArgs(DataManagerError):
     pass
 
 
+class FindOptions(BaseModel):
+    """Keyset paging of a find, documents are ordered by (sort, _id) ascending
+
+    after: [sort value, _id] of the last document of the previous page
+    fields: projection, None for whole documents
+    """
+
+    limit: int | None = None
+    sort: str = "_id"
+    after: List[Any] | None = None
+    batch_size: int | None = None
+    fields: List[str] | None = None
+
+
 @runtime_checkable
 class DataManager(Protocol):
     @classmethod
@@ -55,6 +80,7 @@ class DataManager(Protocol):
     async def get(
         cls,
         query: Dict[str, Any],
+        options: FindOptions | None = None,
     ) -> List[Dict[str, Any]]: ...
     @classmethod
     async def create(
@@ -74,3 +100,178 @@ class DataManager(Protocol):
         cls,
         query: Dict[str, Any],
     ) -> bool: ...
+
+
+@runtime_checkable
+class CacheManager(DataManager, Protocol):
+    """DataManager that only mirrors a source of truth and can be filled from it
+
+    Fills pass `since`, the time.time() their data was read from (None if
+    unknown), a fill outdated by an invalidation after it isn't cached.
+    """
+
+    @classmethod
+    async def get_entry(
+        cls,
+        query: Dict[str, Any],
+        options: FindOptions | None = None,
+    ) -> Tuple[List[Dict[str, Any]], bool]: ...
+
+    @classmethod
+    async def fill(
+        cls,
+        query: Dict[str, Any],
+        data: List[Dict[str, Any]],
+        options: FindOptions | None = None,
+        since: float | None = None,
+    ) -> bool: ...
+
+    @classmethod
+    async def lock_refresh(
+        cls,
+        query: Dict[str, Any],
+        options: FindOptions | None = None,
+    ) -> bool: ...
+
+
+@runtime_checkable
+class DocumentCacheManager(CacheManager, Protocol):
+    """CacheManager that also caches documents one by one under their _id"""
+
+    @classmethod
+    async def get_documents(cls, ids: List[Any]) -> Dict[str, Dict[str, Any]]:
+        """str(_id) -> document of every cached id"""
+        ...
+
+    @classmethod
+    async def fill_documents(
+        cls, documents: List[Dict[str, Any]], since: float | None = None
+    ) -> bool: ...
+
+
+@runtime_checkable
+class BatchCacheManager(CacheManager, Protocol):
+    """CacheManager able to store many fills in one round trip"""
+
+    @classmethod
+    async def fill_many(
+        cls,
+        fills: List[
+            Tuple[
+                Dict[str, Any], List[Dict[str, Any]], FindOptions | None, float | None
+            ]
+        ],
+    ) -> bool:
+        """fill of every (query, data, options, since)"""
+        ...
+
+
+@runtime_checkable
+class BulkManager(DataManager, Protocol):
+    """DataManager able to insert many documents reporting failures per item"""
+
+    @classmethod
+    async def bulk_create(
+        cls,
+        create_data: List[Dict[str, Any]],
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]: ...
+
+
+@runtime_checkable
+class BulkUpdateManager(DataManager, Protocol):
+    """DataManager applying many (query, update) operations in one round trip
+
+    Caches evict whatever the operations may change and report nothing.
+    """
+
+    @classmethod
+    async def bulk_update(
+        cls,
+        operations: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """(matched documents, {"index", "code", "message"} per failed operation)"""
+        ...
+
+
+@runtime_checkable
+class CountManager(DataManager, Protocol):
+    @classmethod
+    async def count(cls, query: Dict[str, Any]) -> int: ...
+
+
+@runtime_checkable
+class CountCacheManager(CacheManager, Protocol):
+    """CacheManager keeping counts of queries for a short while"""
+
+    @classmethod
+    async def get_count(cls, query: Dict[str, Any]) -> int | None: ...
+
+    @classmethod
+    async def fill_count(cls, query: Dict[str, Any], count: int) -> bool: ...
+
+
+@runtime_checkable
+class VersionManager(DataManager, Protocol):
+    """DataManager keeping versions that change with every write of the collection"""
+
+    @classmethod
+    async def get_version(cls, ids: List[Any] | None = None) -> Tuple[str, float]:
+        """(version, unix time of the last write it covers) of the collection,
+        of documents ids when given"""
+        ...
+
+    @classmethod
+    async def bump_version(cls, ids: List[Any] | None = None) -> bool:
+        """Changes the collection version and the versions of documents ids,
+        of every document when the written ones aren't known (None)"""
+        ...
+
+
+@runtime_checkable
+class StreamingManager(DataManager, Protocol):
+    """DataManager able to yield documents as the storage returns them"""
+
+    @classmethod
+    def iterate(
+        cls,
+        query: Dict[str, Any],
+        options: FindOptions | None = None,
+    ) -> AsyncIterator[Dict[str, Any]]: ...
+
+
+@runtime_checkable
+class PrefixIndexManager(CacheManager, Protocol):
+    """CacheManager keeping a case-folded prefix index of the model's _prefix_fields"""
+
+    @classmethod
+    async def search_prefix(
+        cls, field: str, prefix: str, limit: int
+    ) -> List[Dict[str, Any]] | None:
+        """[{_id, field}] of the first limit values starting with the case-folded
+        prefix in index order, None while the index of field isn't built"""
+        ...
+
+    @classmethod
+    async def index_prefixes(cls, documents: List[Dict[str, Any]]) -> bool:
+        """Adds documents ({_id, fields...}), replacing their previous values"""
+        ...
+
+    @classmethod
+    async def unindex_prefixes(cls, ids: List[Any]) -> bool: ...
+
+    @classmethod
+    async def rebuild_prefix_index(
+        cls, field: str, documents: AsyncIterator[Dict[str, Any]]
+    ) -> bool:
+        """Indexes every document of the source, False if another rebuild runs"""
+        ...
+
+
+@runtime_checkable
+class PrefixSearchManager(DataManager, Protocol):
+    """DataManager able to find documents by a case-insensitive field prefix"""
+
+    @classmethod
+    async def find_prefix(
+        cls, field: str, prefix: str, limit: int
+    ) -> List[Dict[str, Any]]: ...
@@ -1,12 +1,50 @@
-from pydantic import BaseModel, ConfigDict, Field, field_validator
-from typing import Dict, Any, List, Union
+from pydantic_core import PydanticUndefined
+from pydantic import (
+    BaseModel,
+    BeforeValidator,
+    ConfigDict,
+    Field,
+    create_model,
+    field_validator,
+)
+from typing import (
+    Dict,
+    Any,
+    List,
+    Union,
+    Annotated,
+    ClassVar,
+    Tuple,
+    Type,
+    Callable,
+)
+from inspect import isclass
 from abc import abstractmethod
+from copy import copy, deepcopy
+from datetime import datetime
+from functools import lru_cache, partial
 from bson import ObjectId
 
 
+def _object_id_to_str(v):
+    if isinstance(v, ObjectId):
+        return str(v)
+    return v
+
+
 class Document(BaseModel):
     __slots__ = ()
     id: str = Field(default="", alias="_id")
+    # always part of a projection, caches tag results by them
+    _projection_fields: ClassVar[Tuple[str, ...]] = ("_id",)
+    # string fields searchable by case-insensitive prefix (see CRUD.search)
+    _prefix_fields: ClassVar[Tuple[str, ...]] = ()
+    # left out of stored documents while they hold their default, reads fill
+    # them back in. Never list indexed or queried fields, storage would no
+    # longer match queries on their default value
+    _sparse_fields: ClassVar[Tuple[str, ...]] = ()
+    # pymongo IndexModels with explicit names, reconciled on startup
+    _indexes: ClassVar[List[Any]] = []
     model_config = ConfigDict(
         validate_by_alias=True,
         validate_by_name=True,
@@ -17,14 +55,67 @@ class Document(BaseModel):
     @classmethod
     def convert_objectid_to_str(cls, v):
         """Convert ObjectId to string if needed"""
-        if isinstance(v, ObjectId):
-            return str(v)
-        return v
+        return _object_id_to_str(v)
 
     @classmethod
     @abstractmethod
     async def get_find_query(cls, data: BaseModel) -> Dict[str, Any]: ...
 
+    @classmethod
+    async def get_find_options(cls, data: BaseModel) -> Any:
+        """FindOptions (paging) of a find, None for a plain find"""
+        return None
+
+    def storage_dump(self) -> Dict[str, Any]:
+        """Document as stored, without _id and with _sparse_fields made sparse"""
+        return self.to_storage(self.model_dump(exclude={"id"}))
+
+    @classmethod
+    def to_storage(cls, document: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy of a dumped document without the parts of _sparse_fields that
+        equal their default, down to keys of nested models"""
+        defaults = _sparse_defaults(cls)
+        if not defaults:
+            return document
+        stored = {}
+        for key, value in document.items():
+            if key in defaults:
+                value = _sparse(value, defaults[key])
+                if value is _OMIT:
+                    continue
+            stored[key] = value
+        return stored
+
+    @classmethod
+    async def get_lookup_ids(
+        cls, query: Dict[str, Any], options: Any = None
+    ) -> List[Any] | None:
+        """_id values of a query matching on _id only, None for any other query
+
+        Such queries can be served from per-document cache entries.
+        """
+        if options is not None:
+            return None
+        # get_find_query wraps conditions in $and / $or
+        while len(query) == 1 and next(iter(query)) in ("$and", "$or"):
+            conditions = next(iter(query.values()))
+            if len(conditions) != 1:
+                return None
+            query = conditions[0]
+        if query.keys() != {"_id"}:
+            return None
+        condition = query["_id"]
+        if isinstance(condition, dict):
+            if condition.keys() != {"$in"}:
+                return None
+            return list(dict.fromkeys(condition["$in"]))
+        return [condition]
+
+    @classmethod
+    async def get_query_shapes(cls) -> Dict[str, Tuple[Dict[str, Any], Any]]:
+        """name -> (find query, FindOptions) of every query shape the API produces"""
+        return {}
+
     @classmethod
     @abstractmethod
     async def get_update_data(cls, data: BaseModel) -> Dict[str, Any]: ...
@@ -32,3 +123,225 @@ class Document(BaseModel):
     @classmethod
     @abstractmethod
     async def get_create_data(cls, data: BaseModel) -> List[Dict[str, Any]]: ...
+
+
+@lru_cache(maxsize=256)
+def partial_model(model: Type[BaseModel], fields: frozenset[str]) -> Type[BaseModel]:
+    """Model with only `fields` (by alias or name) of model, other keys are ignored"""
+    definitions = {}
+    for name, info in model.model_fields.items():
+        key = info.alias or name
+        if key not in fields and name not in fields:
+            continue
+        annotation = info.annotation
+        if key == "_id":
+            annotation = Annotated[annotation, BeforeValidator(_object_id_to_str)]
+        definitions[name] = (annotation, copy(info))
+    return create_model(
+        f"Partial{model.__name__}",
+        __config__=ConfigDict(
+            validate_by_alias=True,
+            validate_by_name=True,
+            extra="ignore",
+        ),
+        **definitions,
+    )
+
+
+def construct_trusted(model: Type[BaseModel], data: Dict[str, Any]) -> BaseModel:
+    """Builds model from data written by us without validating it
+
+    Like model_construct, plus nested models, ObjectId -> str and ISO strings
+    of datetime fields (entries of json codecs) as validation would do, but
+    through a plan compiled once per model (see _trusted_builder). data is
+    keyed as stored, by alias.
+    """
+    return _trusted_builder(model)(data)
+
+
+def construct_trusted_many(
+    model: Type[BaseModel], items: List[Dict[str, Any] | BaseModel]
+) -> List[BaseModel]:
+    """construct_trusted of every dict of items, instances of model are kept"""
+    build = _trusted_builder(model)
+    return [item if type(item) is model else build(item) for item in items]
+
+
+_OMIT = object()
+
+
+@lru_cache(maxsize=256)
+def _sparse_defaults(model: Type[Document]) -> Dict[str, Any]:
+    """Dumped default of every sparse field of model"""
+    defaults = {}
+    for name in model._sparse_fields:
+        default = model.model_fields[name].get_default(call_default_factory=True)
+        if isinstance(default, BaseModel):
+            default = default.model_dump()
+        defaults[name] = default
+    return defaults
+
+
+def _sparse(value: Any, default: Any) -> Any:
+    """value without the dict keys equal to their default, _OMIT if all of it is"""
+    if value == default:
+        return _OMIT
+    if isinstance(value, dict) and isinstance(default, dict):
+        sparse = {}
+        for key, item in value.items():
+            if key in default:
+                item = _sparse(item, default[key])
+                if item is _OMIT:
+                    continue
+            sparse[key] = item
+        # {} validates to the default as well
+        return sparse or _OMIT
+    return value
+
+
+# key shapes a builder keeps plans of, further shapes compile theirs per call
+_PLANS_PER_MODEL = 64
+# default factories written as displays in plans
+_LITERALS = {dict: "{}", list: "[]"}
+_IMMUTABLE = (str, int, float, bool, bytes, tuple, frozenset, type(None))
+# slot setters of BaseModel, what model_construct does through object.__setattr__
+_set_dict = BaseModel.__dict__["__dict__"].__set__
+_set_fields_set = BaseModel.__dict__["__pydantic_fields_set__"].__set__
+_set_extra = BaseModel.__dict__["__pydantic_extra__"].__set__
+_set_private = BaseModel.__dict__["__pydantic_private__"].__set__
+
+
+def _to_datetime(value: Any) -> Any:
+    return datetime.fromisoformat(value) if type(value) is str else value
+
+
+def _nested_builder(nested: Type[BaseModel]) -> Callable[[Any], Any]:
+    """Converter of stored dicts to nested, its builder is looked up on first
+    use so models may nest themselves"""
+    builder = None
+
+    def build(value: Any) -> Any:
+        nonlocal builder
+        if type(value) is not dict:
+            return value
+        if builder is None:
+            builder = _trusted_builder(nested)
+        return builder(value)
+
+    return build
+
+
+def _builds_defaults(factory: Callable[[], Any], nested: Type[BaseModel]) -> bool:
+    """Whether factory returns nested with every field at its default"""
+    sample = factory()
+    return (
+        type(sample) is nested
+        and not sample.model_fields_set
+        and sample.model_dump() == nested.model_construct().model_dump()
+    )
+
+
+@lru_cache(maxsize=256)
+def _trusted_builder(model: Type[BaseModel]) -> Callable[[Dict[str, Any]], BaseModel]:
+    """Function building model from stored data, see construct_trusted
+
+    Stored documents of a model come in a few key shapes, each gets a plan:
+    a function compiled from source (like dataclasses does for __init__)
+    that copies the present fields, fills the missing ones and converts the
+    few fields that need it in one dict display. Missing fields get their
+    default factory or default, deep copied like get_default does unless
+    immutable. Converters keep values already of the field type.
+    """
+    fields = []
+    for name, info in model.model_fields.items():
+        key = info.alias or name
+        annotation = info.annotation
+        factory = info.default_factory
+        default = info.default
+        convert = None
+        if factory is not None and info.default_factory_takes_validated_data:
+            raise TypeError(f"{model.__name__}.{name} default factory takes data")
+        if isclass(annotation) and issubclass(annotation, BaseModel):
+            convert = _nested_builder(annotation)
+            # default factories of nested models validate, the builder doesn't
+            if factory is not None and _builds_defaults(factory, annotation):
+                factory = partial(convert, {})
+        elif annotation is datetime:
+            convert = _to_datetime
+        elif key == "_id":
+            convert = _object_id_to_str
+        if factory is None and (
+            default is not PydanticUndefined and not isinstance(default, _IMMUTABLE)
+        ):
+            factory = partial(deepcopy, default)
+        fields.append((key, name, factory, default, convert))
+    keys = frozenset(key for key, *_ in fields)
+    allow_extra = model.model_config.get("extra") == "allow"
+    plans: Dict[Tuple[str, ...], Callable[[Dict[str, Any]], BaseModel]] = {}
+
+    def compile_plan(shape: Tuple[str, ...]) -> Callable[[Dict[str, Any]], BaseModel]:
+        present = set(shape)
+        namespace = {
+            "model": model,
+            "new": model.__new__,
+            "set_dict": _set_dict,
+            "set_fields_set": _set_fields_set,
+            "set_extra": _set_extra,
+            "set_private": _set_private,
+        }
+        # in field order, dumps of extra allowing models follow __dict__
+        values = []
+        fields_set = []
+        for i, (key, name, factory, default, convert) in enumerate(fields):
+            if key in present:
+                value = f"data[k{i}]"
+                namespace[f"k{i}"] = key
+                fields_set.append(f"{name!r}")
+            elif factory in _LITERALS:
+                value = _LITERALS[factory]
+            elif factory is not None:
+                value = f"f{i}()"
+                namespace[f"f{i}"] = factory
+            elif default is not PydanticUndefined:
+                value = f"d{i}"
+                namespace[f"d{i}"] = default
+            else:
+                # model_construct leaves required fields out
+                continue
+            if convert is not None:
+                value = f"c{i}({value})"
+                namespace[f"c{i}"] = convert
+            values.append(f"{name!r}: {value}")
+        extra = "None"
+        if allow_extra:
+            # validation counts extra keys as set, model_construct doesn't
+            extra_keys = [
+                (f"e{i}", key) for i, key in enumerate(shape) if key not in keys
+            ]
+            namespace.update(extra_keys)
+            fields_set += [name for name, _ in extra_keys]
+            extra = ", ".join(f"{name}: data[{name}]" for name, _ in extra_keys)
+            extra = f"{{{extra}}}"
+        fields_set = f"{{{', '.join(fields_set)}}}" if fields_set else "set()"
+        source = (
+            "def build(data):\n"
+            "    instance = new(model)\n"
+            f"    set_dict(instance, {{{', '.join(values)}}})\n"
+            f"    set_fields_set(instance, {fields_set})\n"
+            f"    set_extra(instance, {extra})\n"
+            "    set_private(instance, None)\n"
+            "    return instance\n"
+        )
+        exec(source, namespace)
+        return namespace["build"]
+
+    def build(data: Dict[str, Any]) -> BaseModel:
+        shape = tuple(data)
+        plan = plans.get(shape)
+        if plan is None:
+            plan = compile_plan(shape)
+            if len(plans) < _PLANS_PER_MODEL:
+                plans[shape] = plan
+        return plan(data)
+
+    return build
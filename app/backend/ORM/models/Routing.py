@@ -0,0 +1,208 @@
+from asyncio import get_running_loop
+from collections import deque
+from contextlib import contextmanager
+from contextvars import Context, ContextVar, copy_context
+from time import monotonic
+from typing import Any, Deque, Dict, Iterator
+from models.DataManager import DataManagerError
+
+# loop.time() by which the current request must be done, None for no limit
+_deadline: ContextVar[float | None] = ContextVar("crud_deadline", default=None)
+
+_CLOSED = "closed"
+_OPEN = "open"
+_HALF_OPEN = "half_open"
+_STATE_CODES = {_CLOSED: 0, _OPEN: 1, _HALF_OPEN: 2}
+
+
+class CircuitOpen(DataManagerError):
+    pass
+
+
+class ManagerHealth:
+    """EWMA latency and error rate, recent latencies and breaker state of a manager"""
+
+    __slots__ = (
+        "latency",
+        "error_rate",
+        "calls",
+        "failures",
+        "recent",
+        "state",
+        "opened_at",
+        "probing",
+    )
+
+    def __init__(self, window: int) -> None:
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.calls = 0
+        # consecutive unavailability errors
+        self.failures = 0
+        self.recent: Deque[float] = deque(maxlen=window)
+        self.state = _CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+
+    def percentile(self, q: float) -> float | None:
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+class Router:
+    """Per manager health for hedged reads and circuit breaking
+
+    A breaker opens after `failure_threshold` consecutive unavailability
+    errors (timeouts, connection errors, the manager's _unavailable_errors),
+    or when the error rate EWMA passes `error_rate_threshold`. Calls are
+    skipped while open, after `open_for` seconds one half-open probe is let
+    through and closes the breaker if it succeeds.
+
+    Hedge delay is the `hedge_percentile` latency of recent calls, clamped
+    to [min_hedge_delay, max_hedge_delay].
+    """
+
+    def __init__(
+        self,
+        *,
+        alpha: float = 0.2,
+        window: int = 256,
+        hedge_percentile: float = 0.95,
+        min_hedge_delay: float = 0.002,
+        max_hedge_delay: float = 0.25,
+        failure_threshold: int = 5,
+        error_rate_threshold: float = 0.5,
+        min_calls: int = 20,
+        open_for: float = 5.0,
+    ) -> None:
+        self.alpha = alpha
+        self.window = window
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_calls = min_calls
+        self.open_for = open_for
+        self._health: Dict[type, ManagerHealth] = {}
+
+    def health(self, manager: type) -> ManagerHealth:
+        health = self._health.get(manager)
+        if health is None:
+            health = self._health[manager] = ManagerHealth(self.window)
+        return health
+
+    def allow(self, manager: type) -> bool:
+        health = self.health(manager)
+        if health.state == _CLOSED:
+            return True
+        if health.state == _OPEN:
+            if monotonic() - health.opened_at < self.open_for:
+                return False
+            health.state = _HALF_OPEN
+            health.probing = False
+        if health.probing:
+            return False
+        health.probing = True
+        return True
+
+    def record(
+        self, manager: type, latency: float, error: Exception | None = None
+    ) -> None:
+        health = self.health(manager)
+        unavailable = error is not None and self.is_unavailable(manager, error)
+        health.calls += 1
+        health.recent.append(latency)
+        health.latency += self.alpha * (latency - health.latency)
+        health.error_rate += self.alpha * (unavailable - health.error_rate)
+
+        if health.state == _HALF_OPEN:
+            health.probing = False
+            if unavailable:
+                self._open(health)
+            else:
+                health.state = _CLOSED
+                health.failures = 0
+                health.error_rate = 0.0
+            return
+        if not unavailable:
+            health.failures = 0
+            return
+        health.failures += 1
+        if health.failures >= self.failure_threshold or (
+            health.calls >= self.min_calls
+            and health.error_rate >= self.error_rate_threshold
+        ):
+            self._open(health)
+
+    @staticmethod
+    def is_unavailable(manager: type, error: Exception) -> bool:
+        """Errors telling the backend is down or slow, not that the call was wrong"""
+        return isinstance(
+            error,
+            (
+                TimeoutError,
+                ConnectionError,
+                *getattr(manager, "_unavailable_errors", ()),
+            ),
+        )
+
+    def cancelled(self, manager: type) -> None:
+        """A cancelled half-open probe lets the next call probe instead"""
+        health = self.health(manager)
+        if health.state == _HALF_OPEN:
+            health.probing = False
+
+    def hedge_delay(self, manager: type) -> float:
+        latency = self.health(manager).percentile(self.hedge_percentile)
+        if latency is None:
+            return self.max_hedge_delay
+        return min(max(latency, self.min_hedge_delay), self.max_hedge_delay)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            manager.__name__: {
+                "latency_ewma": health.latency,
+                "error_rate_ewma": health.error_rate,
+                "hedge_delay": self.hedge_delay(manager),
+                "circuit_state": _STATE_CODES[health.state],
+            }
+            for manager, health in self._health.items()
+        }
+
+    def _open(self, health: ManagerHealth) -> None:
+        health.state = _OPEN
+        health.opened_at = monotonic()
+        health.failures = 0
+
+
+@contextmanager
+def deadline(seconds: float | None) -> Iterator[None]:
+    """Every manager call inside must finish within seconds from now
+
+    Nested deadlines only ever shorten the outer one.
+    """
+    if seconds is None:
+        yield
+        return
+    at = get_running_loop().time() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(at, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def current_deadline() -> float | None:
+    """loop.time() deadline of the current request, use with asyncio.timeout_at"""
+    return _deadline.get()
+
+
+def detached_context() -> Context:
+    """Context for background work outliving the request, without its deadline"""
+    context = copy_context()
+    context.run(_deadline.set, None)
+    return context
@@ -0,0 +1,43 @@
+from asyncio import Task, create_task as asyncio_create_task, shield as asyncio_shield
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+R = TypeVar("R")
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight call
+
+    The call runs in its own task, so a cancelled caller (client gone)
+    doesn't cancel it for the others. Every caller gets the same result
+    object, it must not be mutated.
+    """
+
+    def __init__(self) -> None:
+        self._in_flight: Dict[Hashable, Task] = {}
+        self.calls = 0
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[R]]) -> R:
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio_create_task(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio_shield(task)
+
+    def _forget(self, key: Hashable, task: Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
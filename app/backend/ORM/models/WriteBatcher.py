@@ -0,0 +1,109 @@
+from asyncio import (
+    Future,
+    Task,
+    TimerHandle,
+    create_task as asyncio_create_task,
+    get_running_loop,
+    timeout as asyncio_timeout,
+)
+from contextvars import Context
+from typing import Any, Awaitable, Callable, Dict, Generic, List, Set, Tuple, TypeVar
+from helpers.metrics import metrics
+
+I = TypeVar("I")
+R = TypeVar("R")
+
+
+class WriteBatcher(Generic[I, R]):
+    """Coalesces concurrent writes into one flush call
+
+    Items are collected for up to `window` seconds after the first one, or
+    until `max_batch` of them are queued, then passed to flush(items) at
+    once. flush returns one result per item, an Exception instance fails only
+    that item's caller, a raised exception fails the whole batch.
+
+    Flushes run in an empty context under their own `timeout`, whichever
+    caller opened the batch, its deadline and other context variables don't
+    carry over to the items of the others.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List[I]], Awaitable[List[R | Exception]]],
+        *,
+        name: str,
+        window: float = 0.002,
+        max_batch: int = 500,
+        timeout: float | None = None,
+    ) -> None:
+        self._flush = flush
+        self.name = name
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._queue: List[Tuple[I, Future]] = []
+        self._timer: TimerHandle | None = None
+        self._flushing: Set[Task] = set()
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item: I) -> R:
+        loop = get_running_loop()
+        future = loop.create_future()
+        self._queue.append((item, future))
+        if len(self._queue) >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(
+                self.window, self._start_flush, context=Context()
+            )
+        return await future
+
+    async def flush(self) -> None:
+        """Flushes queued items now and waits for every running flush"""
+        self._start_flush()
+        while self._flushing:
+            await next(iter(self._flushing))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "queued": len(self._queue),
+        }
+
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._queue:
+            return
+        batch, self._queue = self._queue, []
+        task = asyncio_create_task(self._run(batch), context=Context())
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _run(self, batch: List[Tuple[I, Future]]) -> None:
+        self.batches += 1
+        self.items += len(batch)
+        metrics.batch(self.name, len(batch))
+        try:
+            async with asyncio_timeout(self.timeout):
+                results = await self._flush([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f"{self.name} flush returned {len(results)} results "
+                    f"for {len(batch)} items"
+                )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,143 @@
+from datetime import timedelta
+from typing import Dict, Any, List, Tuple, Set, Iterable, Type, ClassVar
+from pydantic import BaseModel
+from models.Document import Document
+import time
+
+# invalidation times are kept this long, fills of older reads are dropped
+_INVALIDATION_TTL = timedelta(minutes=1)
+# invalidation times may come from the clock of another worker
+_CLOCK_SKEW = 0.05
+
+
+class CacheTags:
+    """Reverse index tags telling which cached query results a write can change
+
+    A cached result is tagged with every tag field value of its documents and
+    of its query (or the wildcard tag when the query filters on other fields),
+    a write invalidates the tags of the documents it touches plus the wildcard.
+
+    Invalidations also record when they happened, a fill whose read started
+    before an invalidation of one of its tags would cache pre-write data
+    and is dropped (see _outdated).
+    """
+
+    _model_class: Type[Document]
+    _tag_fields: ClassVar[Tuple[str, ...]] = ("_id", "nickname")
+    _invalidation_ttl: ClassVar[timedelta] = _INVALIDATION_TTL
+
+    @classmethod
+    def _get_key_prefix(cls) -> str:
+        return cls._model_class.__name__.lower() + "s:"
+
+    @classmethod
+    def _tag(cls, field: str, value: Any) -> str:
+        return f"{cls._get_key_prefix()}tag:{field}={value}"
+
+    @classmethod
+    def _wildcard_tag(cls) -> str:
+        """Tag of queries not bound by tag fields, any write may change them"""
+        return cls._tag("*", "*")
+
+    @classmethod
+    def _query_tags(cls, query: Dict[str, Any]) -> Set[str] | None:
+        """Tags of every value the query matches on, None if it is not bound by tag fields only"""
+        if not query:
+            return None
+        tags = set()
+        for field, condition in query.items():
+            if field in ("$and", "$or"):
+                for sub_query in condition:
+                    sub_tags = cls._query_tags(sub_query)
+                    if sub_tags is None:
+                        return None
+                    tags |= sub_tags
+            elif field in cls._tag_fields:
+                if isinstance(condition, dict):
+                    if condition.keys() != {"$in"}:
+                        return None
+                    values = condition["$in"]
+                else:
+                    values = [condition]
+                tags.update(cls._tag(field, value) for value in values)
+            else:
+                return None
+        return tags
+
+    @classmethod
+    def _document_tags(
+        cls, documents: Iterable[Dict[str, Any] | BaseModel]
+    ) -> Set[str]:
+        tags = set()
+        for document in documents:
+            if isinstance(document, BaseModel):
+                document = cls._tag_values(document)
+            tags.update(
+                cls._tag(field, document[field])
+                for field in cls._tag_fields
+                if field in document
+            )
+        return tags
+
+    @classmethod
+    def _tag_values(cls, document: BaseModel) -> Dict[str, Any]:
+        """Tag fields of a validated document, tag fields are named by alias"""
+        values = {}
+        for name, field in type(document).model_fields.items():
+            key = field.alias or name
+            if key in cls._tag_fields:
+                values[key] = getattr(document, name)
+        return values
+
+    @classmethod
+    def _read_tags(
+        cls, query: Dict[str, Any], documents: List[Dict[str, Any] | BaseModel]
+    ) -> Set[str]:
+        query_tags = cls._query_tags(query)
+        if query_tags is None:
+            query_tags = {cls._wildcard_tag()}
+        return query_tags | cls._document_tags(documents)
+
+    @classmethod
+    def _update_tags(
+        cls, query: Dict[str, Any], update_data: Dict[str, Any]
+    ) -> Set[str] | None:
+        """_write_tags of an update, new tag field values come from its $set"""
+        if any(key.startswith("$") for key in update_data):
+            update_data = update_data.get("$set", {})
+        return cls._write_tags(query, [update_data])
+
+    @classmethod
+    def _bulk_update_tags(
+        cls, operations: Iterable[Tuple[Dict[str, Any], Dict[str, Any]]]
+    ) -> Set[str] | None:
+        tags: Set[str] = set()
+        for query, update_data in operations:
+            operation_tags = cls._update_tags(query, update_data)
+            if operation_tags is None:
+                return None
+            tags |= operation_tags
+        return tags
+
+    @classmethod
+    def _write_tags(
+        cls, query: Dict[str, Any] | None, documents: List[Dict[str, Any]]
+    ) -> Set[str] | None:
+        """None when the written documents can't be told from the query"""
+        tags = {cls._wildcard_tag()} | cls._document_tags(documents)
+        if query is not None:
+            query_tags = cls._query_tags(query)
+            if query_tags is None:
+                return None
+            tags |= query_tags
+        return tags
+
+    @classmethod
+    def _outdated(cls, since: float | None, invalidated: Iterable[float]) -> bool:
+        """Whether a fill of data read from `since` on (None: unknown, kept) must
+        be dropped, invalidated: last invalidation times of its tags"""
+        if since is None:
+            return False
+        if time.time() - since > cls._invalidation_ttl.total_seconds():
+            return True
+        return any(at >= since - _CLOCK_SKEW for at in invalidated)
@@ -1,20 +1,64 @@
 from db_clients import DragonClient
 from datetime import timedelta
-from typing import Dict, Any, List, TypeVar, Generic, Type
-import pickle
-import zlib
+from typing import (
+    Dict,
+    Any,
+    List,
+    Tuple,
+    Set,
+    Iterable,
+    TypeVar,
+    Generic,
+    Type,
+    ClassVar,
+    AsyncIterator,
+    Callable,
+)
+from zlib import crc32
+import random
+import time
 from models.Document import Document
+from models.Codec import Codec, FastCodec
+from models.DataManager import FindOptions
+from models.data_managers.CacheTags import CacheTags
+from helpers.query_keys import serialize_query
 from pydantic import validate_call, ConfigDict
+from redis.asyncio.client import Pipeline
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
 
-# orjson could be used maybe idk yet
 validate_call = validate_call(config=ConfigDict(arbitrary_types_allowed=True))
 T = TypeVar("T", bound=Document)
 
-_CACHE_EXPIRE_TIME = timedelta(hours=3)
+# entry is fresh for soft ttl, then served stale (and revalidated) until hard expiry
+_CACHE_SOFT_TTL = timedelta(minutes=30)
+_CACHE_STALE_TTL = timedelta(hours=3)
+_CACHE_TTL_JITTER = 0.1
+_REFRESH_LOCK_TTL = timedelta(seconds=10)
+# counts aren't tagged, writes don't drop them and they are this stale at most
+_COUNT_TTL = timedelta(seconds=10)
+# a rebuild refreshes its lock after every chunk
+_PREFIX_REBUILD_LOCK_TTL = timedelta(minutes=1)
+_PREFIX_REBUILD_CHUNK = 1000
+# documents share this many version fields, a write changes the versions of
+# every document in the buckets of the ones it wrote
+_VERSION_BUCKETS = 1024
 
 
-class DragonManager(Generic[T]):
+class DragonManager(CacheTags, Generic[T]):
     _model_class: Type[T]
+    _soft_ttl: ClassVar[timedelta] = _CACHE_SOFT_TTL
+    _stale_ttl: ClassVar[timedelta] = _CACHE_STALE_TTL
+    _ttl_jitter: ClassVar[float] = _CACHE_TTL_JITTER
+    _codec: ClassVar[Codec] = FastCodec()
+    # bump to orphan every cached query result after a schema change
+    _key_version: ClassVar[int] = 1
+    _count_ttl: ClassVar[timedelta] = _COUNT_TTL
+    # errors meaning dragonfly is unreachable or overloaded, trip the circuit breaker
+    _unavailable_errors: ClassVar[Tuple[type, ...]] = (
+        RedisConnectionError,
+        RedisTimeoutError,
+    )
 
     @classmethod
     def _get_data_storage(cls) -> str:
@@ -22,61 +66,444 @@ class DragonManager(Generic[T]):
 
     @classmethod
     async def get_data(cls, key: str) -> List[Dict[str, Any]]:
+        data, _ = await cls.get_data_entry(key)
+        return data
+
+    @classmethod
+    async def get_data_entry(cls, key: str) -> Tuple[List[Dict[str, Any]], bool]:
+        """Returns (data, is_stale), entries written before soft ttl are never stale"""
         cache = DragonClient.get_client()
         raw_data = await cache.get(key)
-        if raw_data:
-            decompressed_data = zlib.decompress(raw_data)
-            return pickle.loads(decompressed_data)
-        return []
+        if not raw_data:
+            return [], False
+        entry = cls._codec.decode(raw_data)
+        if isinstance(entry, dict) and "soft_expire" in entry:
+            return entry["data"], entry["soft_expire"] < time.time()
+        return entry, False
 
     @classmethod
     async def set_data(
         cls,
         key: str,
         data: List[Dict[str, Any]] | Dict[str, Any],
+        tags: Iterable[str] = (),
     ) -> bool:
         cache = DragonClient.get_client()
-        pickled_data = pickle.dumps(data)
-        compressed_data = zlib.compress(pickled_data, level=6)
-        await cache.set(key, compressed_data, ex=_CACHE_EXPIRE_TIME)
+        async with cache.pipeline(transaction=False) as pipe:
+            cls._queue_set(pipe, key, data, tags)
+            await pipe.execute()
         return True
 
     @classmethod
-    async def _get_valid_key(cls, key: Dict[str, Any]) -> str:
-        base_str = cls._model_class.__name__.lower() + "s:"
-        base_str += await cls._serialize_key(key)
-        return base_str
+    def _queue_set(
+        cls,
+        pipe: Pipeline,
+        key: str,
+        data: List[Dict[str, Any]] | Dict[str, Any],
+        tags: Iterable[str],
+    ) -> None:
+        soft_ttl = cls._jittered(cls._soft_ttl)
+        hard_ttl = soft_ttl + cls._stale_ttl
+        entry = {"data": data, "soft_expire": time.time() + soft_ttl.total_seconds()}
+        pipe.set(key, cls._codec.encode(entry), ex=hard_ttl)
+        # tag sets outlive every key they point to, dangling members are harmless
+        tag_ttl = cls._soft_ttl * (1 + cls._ttl_jitter) + cls._stale_ttl
+        for tag in (*tags, cls._all_keys_tag()):
+            pipe.sadd(tag, key)
+            pipe.expire(tag, tag_ttl)
 
     @classmethod
-    async def _serialize_key(cls, key_dict: Dict[str, Any]) -> str:
-        escaped_items = []
-        for key, value in sorted(key_dict.items()):
-            esc_key = (
-                str(key).replace("\\", "\\\\").replace("|", "\\|").replace("=", "\\=")
-            )
-            esc_value = (
-                str(value).replace("\\", "\\\\").replace("|", "\\|").replace("=", "\\=")
+    async def get_documents(cls, ids: List[Any]) -> Dict[str, Dict[str, Any]]:
+        """One MGET for every id, str(_id) -> document of the cached ones"""
+        if not ids:
+            return {}
+        cache = DragonClient.get_client()
+        raw_documents = await cache.mget([cls._document_key(i) for i in ids])
+        return {
+            str(document_id): cls._codec.decode(raw)
+            for document_id, raw in zip(ids, raw_documents)
+            if raw
+        }
+
+    @classmethod
+    async def fill_documents(
+        cls, documents: List[Dict[str, Any]], since: float | None = None
+    ) -> bool:
+        """Caches documents under their _id in one pipeline
+
+        Entries are tagged like query results so writes drop them too, they
+        expire after soft ttl and are never served stale.
+        """
+        if not documents:
+            return True
+        by_key = {cls._document_key(d["_id"]): d for d in documents}
+        fills = {
+            key: (cls._document_tags([document]), since)
+            for key, document in by_key.items()
+        }
+
+        def queue(pipe: Pipeline, keys: List[str]) -> None:
+            tagged: Dict[str, List[str]] = {cls._all_keys_tag(): list(keys)}
+            for key in keys:
+                pipe.set(
+                    key,
+                    cls._codec.encode(by_key[key]),
+                    ex=cls._jittered(cls._soft_ttl),
+                )
+                for tag in fills[key][0]:
+                    tagged.setdefault(tag, []).append(key)
+            tag_ttl = cls._soft_ttl * (1 + cls._ttl_jitter) + cls._stale_ttl
+            for tag, tag_keys in tagged.items():
+                pipe.sadd(tag, *tag_keys)
+                pipe.expire(tag, tag_ttl)
+
+        return await cls._guarded_fill(fills, queue)
+
+    @classmethod
+    async def _guarded_fill(
+        cls,
+        fills: Dict[str, Tuple[Set[str], float | None]],
+        queue: Callable[[Pipeline, List[str]], None],
+    ) -> bool:
+        """Writes the keys of fills no invalidation of their tags outdated
+
+        fills: key -> (tags, time its data was read from, None if unknown).
+        queue(pipe, keys) queues the writes of the keys still worth caching,
+        the ones an invalidation outdated while they were written are
+        unlinked again, the invalidation may have missed them.
+        """
+        cache = DragonClient.get_client()
+        all_keys_tag = cls._all_keys_tag()
+        tags = [
+            *{tag for key_tags, _ in fills.values() for tag in key_tags},
+            all_keys_tag,
+        ]
+        markers = [cls._invalidated_key(tag) for tag in tags]
+        guarded = any(since is not None for _, since in fills.values())
+
+        def fresh(keys: Iterable[str], raw_times: List[bytes | None]) -> List[str]:
+            times = {tag: float(at) for tag, at in zip(tags, raw_times) if at}
+            return [
+                key
+                for key in keys
+                if not cls._outdated(
+                    fills[key][1],
+                    [times.get(tag, 0.0) for tag in (*fills[key][0], all_keys_tag)],
+                )
+            ]
+
+        keys = fresh(fills, await cache.mget(markers)) if guarded else list(fills)
+        if not keys:
+            return False
+        async with cache.pipeline(transaction=False) as pipe:
+            queue(pipe, keys)
+            if guarded:
+                pipe.mget(markers)
+            results = await pipe.execute()
+        if guarded and (outdated := set(keys) - set(fresh(keys, results[-1]))):
+            await cache.unlink(*outdated)
+        return True
+
+    @classmethod
+    def _document_key(cls, document_id: Any) -> str:
+        return f"{cls._get_key_prefix()}id:{document_id}"
+
+    @classmethod
+    async def search_prefix(
+        cls, field: str, prefix: str, limit: int
+    ) -> List[Dict[str, Any]] | None:
+        """One ZRANGEBYLEX over the prefix index of field, None until it is built
+
+        Members are <case-folded value> NUL <value> NUL <_id>, all scored 0, so
+        the set is ordered by case-folded value and a prefix is a lex range.
+        """
+        cache = DragonClient.get_client()
+        folded = prefix.casefold().encode()
+        async with cache.pipeline(transaction=False) as pipe:
+            pipe.exists(cls._prefix_key(field, ":ready"))
+            pipe.zrangebylex(
+                cls._prefix_key(field), b"[" + folded, b"[" + folded + b"\xff", 0, limit
             )
-            escaped_items.append(f"{esc_key}={esc_value}")
+            ready, members = await pipe.execute()
+        if not ready:
+            return None
+        documents = []
+        for member in members:
+            _, value, document_id = member.decode().rsplit("\0", 2)
+            documents.append({"_id": document_id, field: value})
+        return documents
+
+    @classmethod
+    async def index_prefixes(cls, documents: List[Dict[str, Any]]) -> bool:
+        """Indexes the _prefix_fields present in documents, dropping their old values
+
+        Every index keeps a hash _id -> member to find the member to replace.
+        """
+        fields = [
+            field
+            for field in cls._model_class._prefix_fields
+            if any(field in document for document in documents)
+        ]
+        if not fields:
+            return True
+        cache = DragonClient.get_client()
+        ids = [str(document["_id"]) for document in documents]
+        async with cache.pipeline(transaction=False) as pipe:
+            for field in fields:
+                pipe.hmget(cls._prefix_key(field, ":members"), ids)
+            previous = await pipe.execute()
+        async with cache.pipeline(transaction=False) as pipe:
+            for field, old_members in zip(fields, previous):
+                index = cls._prefix_key(field)
+                for document_id, document, old in zip(ids, documents, old_members):
+                    if field not in document:
+                        continue
+                    value = document[field]
+                    member = f"{value.casefold()}\0{value}\0{document_id}".encode()
+                    if old is not None and old != member:
+                        pipe.zrem(index, old)
+                    pipe.zadd(index, {member: 0})
+                    pipe.hset(cls._prefix_key(field, ":members"), document_id, member)
+            await pipe.execute()
+        return True
+
+    @classmethod
+    async def unindex_prefixes(cls, ids: List[Any]) -> bool:
+        fields = cls._model_class._prefix_fields
+        if not ids or not fields:
+            return True
+        cache = DragonClient.get_client()
+        ids = [str(document_id) for document_id in ids]
+        async with cache.pipeline(transaction=False) as pipe:
+            for field in fields:
+                pipe.hmget(cls._prefix_key(field, ":members"), ids)
+            previous = await pipe.execute()
+        async with cache.pipeline(transaction=False) as pipe:
+            for field, old_members in zip(fields, previous):
+                if members := [member for member in old_members if member]:
+                    pipe.zrem(cls._prefix_key(field), *members)
+                pipe.hdel(cls._prefix_key(field, ":members"), *ids)
+            await pipe.execute()
+        return True
+
+    @classmethod
+    async def rebuild_prefix_index(
+        cls, field: str, documents: AsyncIterator[Dict[str, Any]]
+    ) -> bool:
+        """Indexes documents chunk by chunk, then marks the index of field built
+
+        Writes keep indexing while a rebuild runs, a document deleted after
+        the rebuild read it can stay indexed until it is written again.
+        """
+        cache = DragonClient.get_client()
+        lock = cls._prefix_key(field, ":rebuild")
+        if not await cache.set(lock, 1, nx=True, ex=_PREFIX_REBUILD_LOCK_TTL):
+            return False
+        try:
+            chunk: List[Dict[str, Any]] = []
+            async for document in documents:
+                chunk.append(document)
+                if len(chunk) >= _PREFIX_REBUILD_CHUNK:
+                    await cls.index_prefixes(chunk)
+                    await cache.expire(lock, _PREFIX_REBUILD_LOCK_TTL)
+                    chunk = []
+            await cls.index_prefixes(chunk)
+            await cache.set(cls._prefix_key(field, ":ready"), 1)
+        finally:
+            await cache.delete(lock)
+        return True
+
+    @classmethod
+    def _prefix_key(cls, field: str, suffix: str = "") -> str:
+        # not tagged, invalidate() never drops an index
+        return f"{cls._get_key_prefix()}prefix:{field}{suffix}"
+
+    @classmethod
+    async def invalidate(cls, tags: Set[str] | None) -> int:
+        """Drops every cached key tagged with any of tags, all keys of the model if None"""
+        cache = DragonClient.get_client()
+        tag_keys = [cls._all_keys_tag()] if tags is None else list(tags)
+        if not tag_keys:
+            return 0
+        keys = await cache.sunion(tag_keys)
+        now = time.time()
+        async with cache.pipeline(transaction=False) as pipe:
+            for tag in tag_keys:
+                pipe.set(cls._invalidated_key(tag), now, ex=cls._invalidation_ttl)
+            pipe.unlink(*keys, *tag_keys)
+            if keys and tags is not None:
+                pipe.srem(cls._all_keys_tag(), *keys)
+            await pipe.execute()
+        return len(keys)
+
+    @classmethod
+    def _all_keys_tag(cls) -> str:
+        return f"{cls._get_key_prefix()}tags:all"
+
+    @classmethod
+    def _invalidated_key(cls, tag: str) -> str:
+        """Time of the last invalidation of tag, read by fills (see _guarded_fill)"""
+        return f"{cls._get_key_prefix()}invalidated:{tag}"
+
+    @classmethod
+    def _jittered(cls, ttl: timedelta) -> timedelta:
+        """Spreads expiry of keys filled together so they don't expire at once"""
+        return ttl * (1 + random.uniform(-cls._ttl_jitter, cls._ttl_jitter))
 
-        return "|".join(escaped_items)
+    @classmethod
+    async def _get_valid_key(
+        cls, key: Dict[str, Any], options: FindOptions | None = None
+    ) -> str:
+        """Same key for equivalent queries, long ones are hashed (see serialize_query)"""
+        return (
+            f"{cls._get_key_prefix()}v{cls._key_version}:"
+            f"{serialize_query(key, options)}"
+        )
 
     @classmethod
     async def get(
         cls,
         query: Dict[str, Any],
+        options: FindOptions | None = None,
     ) -> List[Dict[str, Any]]:
-        valid_key = await cls._get_valid_key(query)
+        valid_key = await cls._get_valid_key(query, options)
         return await cls.get_data(key=valid_key)
 
     @classmethod
-    async def delete(
+    async def get_entry(
+        cls,
+        query: Dict[str, Any],
+        options: FindOptions | None = None,
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        valid_key = await cls._get_valid_key(query, options)
+        return await cls.get_data_entry(key=valid_key)
+
+    @classmethod
+    async def fill(
+        cls,
+        query: Dict[str, Any],
+        data: List[Dict[str, Any]],
+        options: FindOptions | None = None,
+        since: float | None = None,
+    ) -> bool:
+        valid_key = await cls._get_valid_key(query, options)
+        tags = cls._read_tags(query, data)
+        if since is None:
+            return await cls.set_data(key=valid_key, data=data, tags=tags)
+        return await cls._guarded_fill(
+            {valid_key: (tags, since)},
+            lambda pipe, _: cls._queue_set(pipe, valid_key, data, tags),
+        )
+
+    @classmethod
+    async def fill_many(
+        cls,
+        fills: List[
+            Tuple[
+                Dict[str, Any], List[Dict[str, Any]], FindOptions | None, float | None
+            ]
+        ],
+    ) -> bool:
+        """fill of every (query, data, options, since) in one pipeline"""
+        entries: Dict[str, Tuple[List[Dict[str, Any]], Set[str], float | None]] = {}
+        for query, data, options, since in fills:
+            valid_key = await cls._get_valid_key(query, options)
+            entries[valid_key] = (data, cls._read_tags(query, data), since)
+
+        def queue(pipe: Pipeline, keys: List[str]) -> None:
+            for key in keys:
+                data, tags, _ = entries[key]
+                cls._queue_set(pipe, key, data, tags)
+
+        return await cls._guarded_fill(
+            {key: (tags, since) for key, (_, tags, since) in entries.items()}, queue
+        )
+
+    @classmethod
+    async def get_count(cls, query: Dict[str, Any]) -> int | None:
+        cache = DragonClient.get_client()
+        count = await cache.get(cls._count_key(query))
+        return None if count is None else int(count)
+
+    @classmethod
+    async def fill_count(cls, query: Dict[str, Any], count: int) -> bool:
+        cache = DragonClient.get_client()
+        await cache.set(cls._count_key(query), count, ex=cls._count_ttl)
+        return True
+
+    @classmethod
+    def _count_key(cls, query: Dict[str, Any]) -> str:
+        return (
+            f"{cls._get_key_prefix()}count:v{cls._key_version}:{serialize_query(query)}"
+        )
+
+    @classmethod
+    async def get_version(cls, ids: List[Any] | None = None) -> Tuple[str, float]:
+        """Version of the collection, or of documents ids: the fields of their
+        buckets and of writes of unknown documents
+
+        Fields hold <sequence>@<unix time> of their last write. The epoch is
+        set by the first read, a hash lost with Dragonfly gets a new one so
+        an old version never comes back.
+        """
+        if ids is None:
+            fields = ["epoch", "all"]
+        else:
+            fields = ["epoch", "wide", *sorted(cls._version_buckets(ids))]
+        cache = DragonClient.get_client()
+        key = cls._version_key()
+        values = await cache.hmget(key, fields)
+        if values[0] is None:
+            async with cache.pipeline(transaction=False) as pipe:
+                pipe.hsetnx(key, "epoch", f"{time.time():.6f}")
+                pipe.hmget(key, fields)
+                _, values = await pipe.execute()
+        stamps = [value.decode() if value else "" for value in values]
+        written = max(
+            (float(stamp.rpartition("@")[2]) for stamp in stamps[1:] if stamp),
+            default=0.0,
+        )
+        return f"v{cls._key_version}:" + ".".join(s or "-" for s in stamps), written
+
+    @classmethod
+    async def bump_version(cls, ids: List[Any] | None = None) -> bool:
+        cache = DragonClient.get_client()
+        key = cls._version_key()
+        # tells apart writes stamped in the same microsecond
+        sequence = await cache.hincrby(key, "sequence", 1)
+        stamp = f"{sequence}@{time.time():.6f}"
+        fields = ("wide",) if ids is None else cls._version_buckets(ids)
+        await cache.hset(key, mapping=dict.fromkeys(("all", *fields), stamp))
+        return True
+
+    @classmethod
+    def _version_key(cls) -> str:
+        # not tagged, invalidate() never drops versions
+        return f"{cls._get_key_prefix()}version"
+
+    @classmethod
+    def _version_buckets(cls, ids: Iterable[Any]) -> Set[str]:
+        return {f"b:{crc32(str(i).encode()) % _VERSION_BUCKETS}" for i in ids}
+
+    @classmethod
+    async def lock_refresh(
         cls,
         query: Dict[str, Any],
+        options: FindOptions | None = None,
     ) -> bool:
+        """Only one worker revalidates a stale key at a time"""
         cache = DragonClient.get_client()
-        valid_key = await cls._get_valid_key(query)
-        await cache.unlink(valid_key)
+        valid_key = await cls._get_valid_key(query, options)
+        return bool(
+            await cache.set(f"{valid_key}:refresh", 1, nx=True, ex=_REFRESH_LOCK_TTL)
+        )
+
+    @classmethod
+    async def delete(
+        cls,
+        query: Dict[str, Any],
+    ) -> bool:
+        await cls.invalidate(cls._write_tags(query, []))
         return True
 
     @classmethod
@@ -84,9 +511,7 @@ class DragonManager(Generic[T]):
         cls,
         create_data: List[Dict[str, Any]],
     ) -> List[Dict[str, Any]]:
-        valid_key = await cls._get_valid_key({"last_created": True})
-        await cls.set_data(key=valid_key, data=create_data)
-
+        await cls.invalidate(cls._write_tags(None, create_data))
         return []
 
     @classmethod
@@ -95,7 +520,14 @@ class DragonManager(Generic[T]):
         query: Dict[str, Any],
         update_data: Dict[str, Any],
     ) -> bool:
-        valid_key = await cls._get_valid_key(query)
-        await cls.set_data(key=valid_key, data=update_data)
-
+        await cls.invalidate(cls._update_tags(query, update_data))
         return True
+
+    @classmethod
+    async def bulk_update(
+        cls,
+        operations: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """One eviction for everything the operations may change"""
+        await cls.invalidate(cls._bulk_update_tags(operations))
+        return 0, []
@@ -0,0 +1,308 @@
+from asyncio import (
+    Task,
+    CancelledError,
+    create_task as asyncio_create_task,
+    sleep as asyncio_sleep,
+)
+from collections import OrderedDict
+from datetime import timedelta
+from typing import (
+    Dict,
+    Any,
+    List,
+    Tuple,
+    Set,
+    Hashable,
+    TypeVar,
+    Generic,
+    Type,
+    ClassVar,
+)
+from uuid import uuid4
+import json
+import time
+from pydantic import BaseModel
+from db_clients import DragonClient
+from models.Document import Document
+from models.DataManager import FindOptions
+from models.data_managers.CacheTags import CacheTags
+from helpers.query_keys import freeze_query
+
+T = TypeVar("T", bound=Document)
+
+_L1_TTL = timedelta(seconds=5)
+_L1_MAX_ENTRIES = 10_000
+_L1_MAX_BYTES = 64 * 1024 * 1024
+_LISTENER_RETRY_DELAY = 1.0
+
+# invalidations published by this process are already applied locally
+_WORKER_ID = uuid4().hex
+
+
+class _Entry:
+    __slots__ = ("data", "expire", "size", "tags")
+
+    def __init__(
+        self, data: List[BaseModel], expire: float, size: int, tags: Set[str]
+    ) -> None:
+        self.data = data
+        self.expire = expire
+        self.size = size
+        self.tags = tags
+
+
+class LocalManager(CacheTags, Generic[T]):
+    """In-process LRU/TTL cache of already validated documents
+
+    Bounded by entry count and approximate size. Invalidations are applied
+    locally and broadcast to other workers over a Dragonfly pub/sub channel,
+    the per-entry ttl bounds staleness if a message is missed. Fills whose
+    read started before an invalidation of their tags reached this worker
+    are dropped.
+    """
+
+    _model_class: Type[T]
+    _stores_validated: ClassVar[bool] = True
+    _ttl: ClassVar[timedelta] = _L1_TTL
+    _max_entries: ClassVar[int] = _L1_MAX_ENTRIES
+    _max_bytes: ClassVar[int] = _L1_MAX_BYTES
+
+    _entries: ClassVar[OrderedDict[Hashable, _Entry]]
+    _tag_index: ClassVar[Dict[str, Set[Hashable]]]
+    # tag -> time.time() of its last invalidation, oldest first
+    _invalidated: ClassVar[OrderedDict[str, float]]
+    # time.time() of the last invalidation of every entry
+    _invalidated_all: ClassVar[float]
+    _bytes: ClassVar[int]
+    _stats: ClassVar[Dict[str, int]]
+
+    _registry: ClassVar[Dict[str, Type["LocalManager"]]] = {}
+    _listener: ClassVar[Task | None] = None
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._entries = OrderedDict()
+        cls._tag_index = {}
+        cls._invalidated = OrderedDict()
+        cls._invalidated_all = 0.0
+        cls._bytes = 0
+        cls._stats = dict.fromkeys(
+            ("hits", "misses", "evictions", "expirations", "invalidations"), 0
+        )
+        if hasattr(cls, "_model_class"):
+            LocalManager._registry[cls._get_channel()] = cls
+
+    @classmethod
+    def _get_data_storage(cls) -> str:
+        return f"Local : = {(cls._model_class.__name__.lower() + 's',)}"
+
+    @classmethod
+    def _get_channel(cls) -> str:
+        return f"{cls._get_key_prefix()}l1:invalidate"
+
+    @classmethod
+    async def get(
+        cls,
+        query: Dict[str, Any],
+        options: FindOptions | None = None,
+    ) -> List[BaseModel]:
+        data, _ = await cls.get_entry(query, options)
+        return data
+
+    @classmethod
+    async def get_entry(
+        cls,
+        query: Dict[str, Any],
+        options: FindOptions | None = None,
+    ) -> Tuple[List[BaseModel], bool]:
+        key = freeze_query(query, options)
+        entry = cls._entries.get(key)
+        if entry is None:
+            cls._stats["misses"] += 1
+            return [], False
+        if entry.expire < time.monotonic():
+            cls._stats["expirations"] += 1
+            cls._stats["misses"] += 1
+            cls._drop(key)
+            return [], False
+        cls._entries.move_to_end(key)
+        cls._stats["hits"] += 1
+        return entry.data, False
+
+    @classmethod
+    async def fill(
+        cls,
+        query: Dict[str, Any],
+        data: List[BaseModel],
+        options: FindOptions | None = None,
+        since: float | None = None,
+    ) -> bool:
+        tags = cls._read_tags(query, data)
+        invalidated = [cls._invalidated.get(tag, 0.0) for tag in tags]
+        if cls._outdated(since, [*invalidated, cls._invalidated_all]):
+            return False
+        size = _approx_size(data)
+        if size > cls._max_bytes:
+            return False
+        key = freeze_query(query, options)
+        cls._drop(key)
+        cls._entries[key] = _Entry(
+            data, time.monotonic() + cls._ttl.total_seconds(), size, tags
+        )
+        cls._bytes += size
+        for tag in tags:
+            cls._tag_index.setdefault(tag, set()).add(key)
+        while len(cls._entries) > cls._max_entries or cls._bytes > cls._max_bytes:
+            oldest = next(iter(cls._entries))
+            cls._drop(oldest)
+            cls._stats["evictions"] += 1
+        return True
+
+    @classmethod
+    async def lock_refresh(
+        cls,
+        query: Dict[str, Any],
+        options: FindOptions | None = None,
+    ) -> bool:
+        return True
+
+    @classmethod
+    async def create(
+        cls,
+        create_data: List[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        await cls.invalidate(cls._write_tags(None, create_data))
+        return []
+
+    @classmethod
+    async def update(
+        cls,
+        query: Dict[str, Any],
+        update_data: Dict[str, Any],
+    ) -> bool:
+        await cls.invalidate(cls._update_tags(query, update_data))
+        return True
+
+    @classmethod
+    async def bulk_update(
+        cls,
+        operations: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """One eviction for everything the operations may change"""
+        await cls.invalidate(cls._bulk_update_tags(operations))
+        return 0, []
+
+    @classmethod
+    async def delete(
+        cls,
+        query: Dict[str, Any],
+    ) -> bool:
+        await cls.invalidate(cls._write_tags(query, []))
+        return True
+
+    @classmethod
+    async def invalidate(cls, tags: Set[str] | None) -> int:
+        """Drops local entries tagged with any of tags (all if None) on every worker"""
+        dropped = cls._invalidate_local(tags)
+        message = {"origin": _WORKER_ID, "tags": None if tags is None else list(tags)}
+        await DragonClient.get_client().publish(cls._get_channel(), json.dumps(message))
+        return dropped
+
+    @classmethod
+    def _invalidate_local(cls, tags: Set[str] | None) -> int:
+        now = time.time()
+        if tags is None:
+            cls._invalidated_all = now
+            keys = list(cls._entries)
+        else:
+            for tag in tags:
+                cls._invalidated[tag] = now
+                cls._invalidated.move_to_end(tag)
+            keys = {key for tag in tags for key in cls._tag_index.get(tag, ())}
+        expired = now - cls._invalidation_ttl.total_seconds()
+        while cls._invalidated and next(iter(cls._invalidated.values())) < expired:
+            cls._invalidated.popitem(last=False)
+        for key in keys:
+            cls._drop(key)
+        cls._stats["invalidations"] += len(keys)
+        return len(keys)
+
+    @classmethod
+    def _drop(cls, key: Hashable) -> None:
+        entry = cls._entries.pop(key, None)
+        if entry is None:
+            return
+        cls._bytes -= entry.size
+        for tag in entry.tags:
+            keys = cls._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del cls._tag_index[tag]
+
+    @classmethod
+    def clear(cls) -> None:
+        cls._entries.clear()
+        cls._tag_index.clear()
+        cls._bytes = 0
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        return {**cls._stats, "entries": len(cls._entries), "bytes": cls._bytes}
+
+    @staticmethod
+    async def start_listener() -> None:
+        if LocalManager._listener is None and LocalManager._registry:
+            LocalManager._listener = asyncio_create_task(LocalManager._listen())
+
+    @staticmethod
+    async def stop_listener() -> None:
+        if LocalManager._listener is not None:
+            LocalManager._listener.cancel()
+            try:
+                await LocalManager._listener
+            except CancelledError:
+                pass
+            LocalManager._listener = None
+
+    @staticmethod
+    async def _listen() -> None:
+        registry = LocalManager._registry
+        while True:
+            pubsub = DragonClient.get_client().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(*registry)
+                async for message in pubsub.listen():
+                    payload = json.loads(message["data"])
+                    if payload["origin"] == _WORKER_ID:
+                        continue
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    tags = payload["tags"]
+                    registry[channel]._invalidate_local(
+                        None if tags is None else set(tags)
+                    )
+            except CancelledError:
+                raise
+            except Exception as e:
+                print(f"L1 invalidation listener failed: {e}")
+                # messages may have been missed while disconnected
+                for manager in registry.values():
+                    manager.clear()
+                await asyncio_sleep(_LISTENER_RETRY_DELAY)
+            finally:
+                await pubsub.aclose()
+
+
+def _approx_size(value: Any) -> int:
+    """Rough payload size in bytes, cheaper than serializing"""
+    if isinstance(value, BaseModel):
+        return _approx_size(value.__dict__)
+    if isinstance(value, (str, bytes)):
+        return len(value) + 48
+    if isinstance(value, dict):
+        return 64 + sum(_approx_size(k) + _approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return 56 + sum(_approx_size(v) for v in value)
+    return 32
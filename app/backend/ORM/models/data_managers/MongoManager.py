@@ -1,19 +1,49 @@
 from fastapi import Depends
 from db_clients import _get_mongo
-from typing import TypeVar, Dict, Any, List, Type, Generic
-from motor.motor_asyncio import AsyncIOMotorCollection
-from bson import ObjectId
+from asyncio import Semaphore, gather
+import re
+from typing import (
+    TypeVar,
+    Dict,
+    Any,
+    List,
+    Tuple,
+    Type,
+    Generic,
+    AsyncIterator,
+    ClassVar,
+)
+from pymongo import ASCENDING, UpdateMany, UpdateOne
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorCursor
+from bson import ObjectId, encode as bson_encode
+from pymongo.errors import (
+    AutoReconnect,
+    BulkWriteError,
+    ExecutionTimeout,
+    PyMongoError,
+    ServerSelectionTimeoutError,
+)
 from models.Document import Document
-
+from models.DataManager import FindOptions
+from helpers.pagination import keyset_filter, keyset_sort
 
 T = TypeVar("T", bound=Document)
 
+_BULK_CHUNK_SIZE = 1000
+_BULK_CONCURRENCY = 4
+
 
 # TODO : raise exceptions from datamanager
 
 
 class MongoManager(Generic[T]):
     _model_class: Type[T]
+    # errors meaning mongod is unreachable or overloaded, trip the circuit breaker
+    _unavailable_errors: ClassVar[Tuple[type, ...]] = (
+        AutoReconnect,
+        ExecutionTimeout,
+        ServerSelectionTimeoutError,
+    )
 
     @classmethod
     async def _get_collection(
@@ -24,9 +54,77 @@ class MongoManager(Generic[T]):
         return _get_mongo(f"{cls._model_class.__name__.lower()}s")
 
     @classmethod
-    async def get(cls, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+    async def get(
+        cls,
+        query: Dict[str, Any],
+        options: FindOptions | None = None,
+    ) -> List[Dict[str, Any]]:
+        collection = await cls._get_collection()
+        return await cls._find(collection, query, options).to_list()
+
+    @classmethod
+    async def iterate(
+        cls,
+        query: Dict[str, Any],
+        options: FindOptions | None = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Yields documents batch by batch instead of loading the whole result"""
         collection = await cls._get_collection()
-        return await collection.find(query).to_list()
+        async for document in cls._find(collection, query, options):
+            yield document
+
+    @classmethod
+    async def count(cls, query: Dict[str, Any]) -> int:
+        """Metadata count for the whole collection, an index count otherwise"""
+        collection = await cls._get_collection()
+        if not query:
+            return await collection.estimated_document_count()
+        return await collection.count_documents(query)
+
+    @classmethod
+    async def find_prefix(
+        cls,
+        field: str,
+        prefix: str,
+        limit: int,
+    ) -> List[Dict[str, Any]]:
+        """{_id, field} of documents whose field starts with prefix, ignoring case
+
+        Case-insensitive regexes can't bound an index scan, this walks the
+        whole index of field and is only the fallback of prefix indexes.
+        """
+        collection = await cls._get_collection()
+        cursor = collection.find(
+            {field: {"$regex": f"^{re.escape(prefix)}", "$options": "i"}},
+            projection={"_id": 1, field: 1},
+            sort=[(field, ASCENDING)],
+            limit=limit,
+        )
+        return await cursor.to_list()
+
+    @classmethod
+    def _find(
+        cls,
+        collection: AsyncIOMotorCollection,
+        query: Dict[str, Any],
+        options: FindOptions | None,
+    ) -> AsyncIOMotorCursor:
+        if options is None:
+            return collection.find(query)
+        if options.after is not None:
+            after = keyset_filter(options.sort, options.after)
+            query = {"$and": [query, after]} if query else after
+        projection = None
+        if options.fields is not None:
+            projection = dict.fromkeys(options.fields, 1)
+        cursor = collection.find(
+            query, projection=projection, sort=keyset_sort(options.sort)
+        )
+        if options.limit:
+            cursor = cursor.limit(options.limit)
+        if options.batch_size:
+            cursor = cursor.batch_size(options.batch_size)
+        return cursor
 
     @classmethod
     async def create(
@@ -35,11 +133,52 @@ class MongoManager(Generic[T]):
     ) -> List[Dict[str, Any]]:
         collection = await cls._get_collection()
         result = await collection.insert_many(create_data)
-        if result.inserted_ids:
-            t = await cls._get_many_by_id(result.inserted_ids, collection)
-            print(f"{t=}")
-            return t
-        return []
+        return [
+            {**document, "_id": inserted_id}
+            for document, inserted_id in zip(create_data, result.inserted_ids)
+        ]
+
+    @classmethod
+    async def bulk_create(
+        cls,
+        create_data: List[Dict[str, Any]],
+        chunk_size: int = _BULK_CHUNK_SIZE,
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Unordered chunked insert, returns (inserted documents, per item errors)
+
+        Errors carry the index of the failed item in create_data. Inserted
+        documents are the payloads themselves, pymongo sets their _id in place.
+        """
+        collection = await cls._get_collection()
+        semaphore = Semaphore(_BULK_CONCURRENCY)
+
+        async def insert_chunk(start: int) -> Tuple[List[Dict], List[Dict]]:
+            chunk = create_data[start : start + chunk_size]
+            failed: Dict[int, Dict[str, Any]] = {}
+            async with semaphore:
+                try:
+                    await collection.insert_many(chunk, ordered=False)
+                except BulkWriteError as e:
+                    failed = {
+                        error["index"]: error for error in e.details["writeErrors"]
+                    }
+            inserted = [doc for i, doc in enumerate(chunk) if i not in failed]
+            errors = [
+                {
+                    "index": start + i,
+                    "code": error.get("code"),
+                    "message": error.get("errmsg"),
+                }
+                for i, error in sorted(failed.items())
+            ]
+            return inserted, errors
+
+        results = await gather(
+            *(insert_chunk(start) for start in range(0, len(create_data), chunk_size))
+        )
+        inserted = [doc for chunk_inserted, _ in results for doc in chunk_inserted]
+        errors = [error for _, chunk_errors in results for error in chunk_errors]
+        return inserted, errors
 
     @classmethod
     async def update(
@@ -47,10 +186,53 @@ class MongoManager(Generic[T]):
         query: Dict[str, Any],
         update_data: Dict[str, Any],
     ) -> bool:
+        """update_data is an update document, or fields to $set"""
         collection = await cls._get_collection()
-        result = await collection.update_many(query, {"$set": update_data})
+        if not any(key.startswith("$") for key in update_data):
+            update_data = {"$set": update_data}
+        result = await collection.update_many(query, update_data)
         return result.modified_count > 0
 
+    @classmethod
+    async def bulk_update(
+        cls,
+        operations: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+        chunk_size: int = _BULK_CHUNK_SIZE,
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """Unordered chunked bulk_write of update_many per (query, update document)
+
+        Returns (matched documents, per operation errors), errors carry the
+        index of the failed operation.
+        """
+        collection = await cls._get_collection()
+        semaphore = Semaphore(_BULK_CONCURRENCY)
+
+        async def write_chunk(start: int) -> Tuple[int, List[Dict[str, Any]]]:
+            chunk = [
+                UpdateMany(query, update_data)
+                for query, update_data in operations[start : start + chunk_size]
+            ]
+            async with semaphore:
+                try:
+                    result = await collection.bulk_write(chunk, ordered=False)
+                except BulkWriteError as e:
+                    errors = [
+                        {
+                            "index": start + error["index"],
+                            "code": error.get("code"),
+                            "message": error.get("errmsg"),
+                        }
+                        for error in e.details["writeErrors"]
+                    ]
+                    return e.details["nMatched"], errors
+            return result.matched_count, []
+
+        results = await gather(
+            *(write_chunk(start) for start in range(0, len(operations), chunk_size))
+        )
+        errors = [error for _, chunk_errors in results for error in chunk_errors]
+        return sum(matched for matched, _ in results), errors
+
     @classmethod
     async def delete(
         cls,
@@ -61,6 +243,115 @@ class MongoManager(Generic[T]):
         result = await collection.delete_many(query)
         return result.deleted_count > 0
 
+    @classmethod
+    async def sync_indexes(cls) -> Dict[str, List[str]]:
+        """Creates declared indexes that are missing, reports the rest
+
+        Indexes are created one by one so one failing build (e.g. duplicates
+        under a unique index) doesn't block the others.
+        """
+        collection = await cls._get_collection()
+        existing = await collection.index_information()
+        report: Dict[str, List[str]] = {
+            "created": [],
+            "present": [],
+            "mismatched": [],
+            "failed": [],
+            "undeclared": [],
+        }
+        declared = set()
+        for index in cls._model_class._indexes:
+            spec = index.document
+            name = spec["name"]
+            declared.add(name)
+            if name in existing:
+                if list(existing[name]["key"]) != list(spec["key"].items()):
+                    report["mismatched"].append(name)
+                else:
+                    report["present"].append(name)
+                continue
+            try:
+                await collection.create_indexes([index])
+                report["created"].append(name)
+            except PyMongoError as e:
+                report["failed"].append(f"{name}: {e}")
+        report["undeclared"] = [
+            name for name in existing if name != "_id_" and name not in declared
+        ]
+        return report
+
+    @classmethod
+    async def compact(
+        cls, batch_size: int = _BULK_CHUNK_SIZE, dry_run: bool = False
+    ) -> Dict[str, Any]:
+        """Rewrites stored documents in their sparse form (see Document.to_storage)
+
+        A document is only rewritten while the fields being compacted still
+        hold the values read, concurrent writes win. Returns document counts
+        and BSON bytes before / after.
+        """
+        collection = await cls._get_collection()
+        report = {"documents": 0, "compacted": 0, "bytes_before": 0, "bytes_after": 0}
+        updates: List[UpdateOne] = []
+        async for document in collection.find({}, batch_size=batch_size):
+            stored = cls._model_class.to_storage(document)
+            report["documents"] += 1
+            before, after = len(bson_encode(document)), len(bson_encode(stored))
+            report["bytes_before"] += before
+            report["bytes_after"] += after
+            if before == after:
+                continue
+            changed = [key for key in document if stored.get(key) != document[key]]
+            removed = {key: "" for key in changed if key not in stored}
+            update: Dict[str, Any] = {}
+            if removed:
+                update["$unset"] = removed
+            if kept := {key: stored[key] for key in changed if key in stored}:
+                update["$set"] = kept
+            updates.append(
+                UpdateOne(
+                    {"_id": document["_id"], **{k: document[k] for k in changed}},
+                    update,
+                )
+            )
+            if len(updates) >= batch_size:
+                report["compacted"] += await cls._write_compacted(
+                    collection, updates, dry_run
+                )
+                updates = []
+        report["compacted"] += await cls._write_compacted(collection, updates, dry_run)
+        return report
+
+    @classmethod
+    async def _write_compacted(
+        cls,
+        collection: AsyncIOMotorCollection,
+        updates: List[UpdateOne],
+        dry_run: bool,
+    ) -> int:
+        if not updates:
+            return 0
+        if dry_run:
+            return len(updates)
+        result = await collection.bulk_write(updates, ordered=False)
+        return result.modified_count
+
+    @classmethod
+    async def find_collection_scans(cls) -> List[str]:
+        """Names of the model query shapes whose winning plan scans the collection"""
+        collection = await cls._get_collection()
+        scans = []
+        for name, (query, options) in (
+            await cls._model_class.get_query_shapes()
+        ).items():
+            plan = await cls._find(collection, query, options).explain()
+            winning_plan = plan["queryPlanner"]["winningPlan"]
+            # slot based engine nests the classic plan tree
+            winning_plan = winning_plan.get("queryPlan", winning_plan)
+            if _has_stage(winning_plan, "COLLSCAN"):
+                scans.append(name)
+        return scans
+
     @classmethod
     def _get_data_storage(cls) -> str:
         return f"MongoDB : collection = {(cls._model_class.__name__.lower() + 's',)}"
@@ -72,3 +363,12 @@ class MongoManager(Generic[T]):
         collection,
     ) -> List[Dict[str, Any]]:
         return await collection.find({"_id": {"$in": query}}).to_list()
+
+
+def _has_stage(plan: Dict[str, Any], stage: str) -> bool:
+    if plan.get("stage") == stage:
+        return True
+    children = plan.get("inputStages", [])
+    if "inputStage" in plan:
+        children = [plan["inputStage"], *children]
+    return any(_has_stage(child, stage) for child in children)
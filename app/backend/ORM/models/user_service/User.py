@@ -1,11 +1,14 @@
 from models.Document import Document
 from pydantic import BaseModel, EmailStr, Field
-from schemas.user_service.User import GetUser, CreateUser
+from schemas.user_service.User import GetUser, CreateUser, UpdateUser
 from schemas.user_service.user_complex_fields import Socials
-from typing import List, Dict, Any
+from typing import List, Dict, Any, ClassVar, Tuple
+from models.DataManager import FindOptions
+from helpers.pagination import decode_cursor
 
 from datetime import datetime, UTC
 from bson import ObjectId
+from pymongo import IndexModel, ASCENDING
 
 
 def default_league_roles():
@@ -41,6 +44,22 @@ class User(Document):
     created_at: datetime = Field(default_factory=utc_now)
     socials: Socials = Field(default_factory=default_socials)
 
+    _projection_fields: ClassVar[Tuple[str, ...]] = ("_id", "nickname")
+    _prefix_fields: ClassVar[Tuple[str, ...]] = ("nickname",)
+    # gender and league_roles are indexed, they are always stored
+    _sparse_fields: ClassVar[Tuple[str, ...]] = ("riot_accounts", "socials")
+    _indexes: ClassVar[List[IndexModel]] = [
+        IndexModel([("nickname", ASCENDING)], name="nickname_unique", unique=True),
+        IndexModel(
+            [("created_at", ASCENDING), ("_id", ASCENDING)], name="created_at_id"
+        ),
+        IndexModel(
+            [("gender", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+            name="gender_created_at_id",
+        ),
+        IndexModel([("league_roles", ASCENDING)], name="league_roles"),
+    ]
+
     @classmethod
     async def get_find_query(cls, data: BaseModel) -> Dict[str, Any]:
         query = dict()
@@ -59,6 +78,24 @@ class User(Document):
                 else:
                     conditions.append({"nickname": {"$in": data.nicknames}})
 
+            if data.gender is not None:
+                conditions.append({"gender": data.gender})
+
+            if data.roles:
+                if len(data.roles) == 1:
+                    conditions.append({"league_roles": data.roles[0]})
+                else:
+                    operator = "$all" if data.conjuction else "$in"
+                    conditions.append({"league_roles": {operator: data.roles}})
+
+            created_at = {}
+            if data.created_after is not None:
+                created_at["$gte"] = data.created_after
+            if data.created_before is not None:
+                created_at["$lt"] = data.created_before
+            if created_at:
+                conditions.append({"created_at": created_at})
+
             if conditions:
                 if data.conjuction:
                     query["$and"] = conditions
@@ -68,10 +105,82 @@ class User(Document):
         return query
 
     @classmethod
-    async def get_update_data(cls, data: BaseModel) -> Dict[str, Any]: ...
+    async def get_find_options(cls, data: BaseModel) -> FindOptions | None:
+        if not isinstance(data, GetUser):
+            return None
+        if (
+            data.limit is None
+            and data.cursor is None
+            and data.sort == "_id"
+            and data.fields is None
+        ):
+            return None
+        options = FindOptions(limit=data.limit, sort=data.sort, batch_size=data.limit)
+        if data.fields is not None:
+            options.fields = sorted({*data.fields, *cls._projection_fields, data.sort})
+        if data.cursor is not None:
+            _, options.after = decode_cursor(data.cursor)
+        return options
+
+    @classmethod
+    async def get_query_shapes(
+        cls,
+    ) -> Dict[str, Tuple[Dict[str, Any], FindOptions | None]]:
+        some_id, other_id = str(ObjectId()), str(ObjectId())
+        samples = {
+            "by_id": GetUser(ids=[some_id]),
+            "by_ids": GetUser(ids=[some_id, other_id]),
+            "by_nickname": GetUser(nicknames=["sample"]),
+            "by_nicknames": GetUser(nicknames=["sample", "other"]),
+            "by_id_or_nickname": GetUser(
+                ids=[some_id], nicknames=["sample"], conjuction=False
+            ),
+            "by_gender": GetUser(gender="sample"),
+            "by_role": GetUser(roles=["MID"]),
+            "by_all_roles": GetUser(roles=["MID", "TOP"]),
+            "by_created_range": GetUser(
+                created_after=datetime(2024, 1, 1, tzinfo=UTC),
+                created_before=datetime(2025, 1, 1, tzinfo=UTC),
+            ),
+            "page_by_gender": GetUser(gender="sample", limit=50, sort="created_at"),
+            "page_by_id": GetUser(limit=50),
+            "page_by_created_at": GetUser(limit=50, sort="created_at"),
+        }
+        return {
+            name: (await cls.get_find_query(sample), await cls.get_find_options(sample))
+            for name, sample in samples.items()
+        }
+
+    @classmethod
+    async def get_update_data(cls, data: BaseModel) -> Dict[str, Any]:
+        """Smallest update document writing the given fields
+
+        Sparse fields set to their default are $unset like storage_dump
+        leaves them out, socials are updated network by network.
+        """
+        if not isinstance(data, UpdateUser):
+            return {}
+        values = data.model_dump(exclude_none=True, exclude={"id"})
+        update: Dict[str, Dict[str, Any]] = {}
+        if "add_riot_accounts" in values:
+            accounts = values.pop("add_riot_accounts")
+            update["$addToSet"] = {"riot_accounts": {"$each": accounts}}
+        for network, account in values.pop("socials", {}).items():
+            if account:
+                update.setdefault("$set", {})[f"socials.{network}"] = account
+            else:
+                update.setdefault("$unset", {})[f"socials.{network}"] = ""
+        for field, value in values.items():
+            if field in cls._sparse_fields and not cls.to_storage({field: value}):
+                update.setdefault("$unset", {})[field] = ""
+            else:
+                update.setdefault("$set", {})[field] = value
+        return update
 
     @classmethod
     async def get_create_data(cls, data: BaseModel) -> List[Dict[str, Any]]:
         if isinstance(data, CreateUser):
-            return [data.model_dump(exclude={"id"})]
+            # created_at (used for paging) is stored, empty socials and
+            # riot_accounts are not (see _sparse_fields)
+            return [cls.model_validate(data.model_dump()).storage_dump()]
         return []
@@ -1,20 +1,213 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Body, HTTPException, Path, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from helpers.CRUD_instances import user_crud
-from schemas.user_service.User import CreateUser, GetUser
-from typing import Annotated
+from helpers.admission import AdaptiveLimiter
+from helpers.metrics import metrics
+from helpers.pagination import DEFAULT_PAGE_SIZE, encode_cursor
+from helpers.response_cache import ResponseCache
+from pydantic import BaseModel, Field
+from schemas.user_service.User import (
+    OBJECT_ID_PATTERN,
+    BatchUpdateUser,
+    CreateUser,
+    GetUser,
+    SearchUser,
+    UpdateUser,
+)
+from starlette.background import BackgroundTask
+from typing import Annotated, AsyncIterator, Dict, List
+import os
 
 router = APIRouter(prefix="/users", tags=["UserService Route"])
 
+_NDJSON = "application/x-ndjson"
+_MAX_BULK_CREATE = 50_000
+_MAX_BULK_UPDATE = 50_000
+_MAX_BULK_DELETE = 50_000
+
+UserId = Annotated[str, Path(pattern=OBJECT_ID_PATTERN)]
+
+responses = ResponseCache("users:", enabled=os.getenv("ORM_RESPONSE_CACHE", "1") == "1")
+# per worker, keep both max_limits together within MONGO_MAX_POOL_SIZE. Reads
+# and writes adapt apart, slow writes don't shrink the limit of reads
+readers = AdaptiveLimiter(
+    "user_service.users.read",
+    max_limit=int(os.getenv("USERS_MAX_CONCURRENCY", "100")),
+    max_queue=int(os.getenv("USERS_MAX_QUEUE", "200")),
+    max_wait=float(os.getenv("USERS_MAX_QUEUE_WAIT", "1.0")),
+)
+writers = AdaptiveLimiter(
+    "user_service.users.write",
+    initial_limit=10,
+    max_limit=int(os.getenv("USERS_MAX_WRITE_CONCURRENCY", "20")),
+    max_queue=int(os.getenv("USERS_MAX_WRITE_QUEUE", "100")),
+    max_wait=float(os.getenv("USERS_MAX_QUEUE_WAIT", "1.0")),
+)
+# readers priorities, reads the caches usually serve are admitted first
+_CACHED = 0
+_SOURCE = 1
+# writers priorities, bulk writes last and kept out of the limit adaptation,
+# their seconds long latency isn't congestion
+_ITEM = 0
+_BULK = 1
+
 
 @router.get("/")
-async def get_all_users(query: Annotated[GetUser, Query()]):
-    if users := await user_crud.get(query=query):
-        return users
-    raise HTTPException(status_code=404)
+async def get_all_users(query: Annotated[GetUser, Query()], request: Request):
+    if _NDJSON in request.headers.get("accept", ""):
+        return StreamingResponse(_ndjson(query), media_type=_NDJSON)
+    if query.limit is None and not query.ids and not query.nicknames:
+        # only streams dump the whole collection
+        query = query.model_copy(update={"limit": DEFAULT_PAGE_SIZE})
+
+    # before the read, a write landing in between only costs the next poll a 200
+    etag = await user_crud.etag(query)
+    # 304s and response cache hits don't take a limiter slot
+    if etag is None:
+        headers = {}
+    else:
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            metrics.inc("orm_conditional_gets_total", (("result", "not_modified"),))
+            return Response(status_code=304, headers=headers)
+        metrics.inc("orm_conditional_gets_total", (("result", "modified"),))
+
+        encoding = responses.encoding(request.headers.get("accept-encoding"))
+        if cached := await responses.get("get_all_users", etag, encoding):
+            body, encoding, cached_headers = cached
+            headers.update(cached_headers)
+            if encoding != "identity":
+                # RFC 9110 wants strong ETags to differ per content coding
+                headers.update({"Content-Encoding": encoding, "ETag": f"W/{etag}"})
+            return Response(body, media_type="application/json", headers=headers)
+
+    # _id lookups are served from per-document cache entries
+    async with readers.slot(_CACHED if query.ids else _SOURCE):
+        users = await user_crud.get(query=query)
+    response = _users_response(users, query, headers)
+    if etag is None:
+        return response
+    response.background = BackgroundTask(
+        responses.fill,
+        "get_all_users",
+        etag,
+        response.body,
+        {k: v for k, v in headers.items() if k == "X-Next-Cursor"},
+    )
+    return response
+
+
+@router.get("/count")
+async def count_users(query: Annotated[GetUser, Query()]):
+    """Users matching the filters of GET /, may be a few seconds stale"""
+    async with readers.slot(_SOURCE):
+        count = await user_crud.count(query=query)
+    if count is None:
+        raise HTTPException(status_code=503)
+    return {"count": count}
+
+
+@router.get("/search")
+async def search_users(query: Annotated[SearchUser, Query()]):
+    """Nickname autocomplete, {_id, nickname} of up to limit matches"""
+    async with readers.slot(_CACHED):
+        users = await user_crud.search("nickname", query.prefix, query.limit)
+    return Response(user_crud.encode_response(users), media_type="application/json")
 
 
 @router.post("/")
 async def create_user(create_data: CreateUser):
-    if users := await user_crud.create(create_data):
+    async with writers.slot(_ITEM):
+        users = await user_crud.create(create_data)
+    if users:
         return users
     raise HTTPException(status_code=422)
+
+
+@router.post("/bulk")
+async def create_users(
+    create_data: Annotated[
+        List[CreateUser], Body(min_length=1, max_length=_MAX_BULK_CREATE)
+    ],
+):
+    async with writers.slot(_BULK, adapt=False):
+        users, errors = await user_crud.bulk_create(create_data)
+    if not users:
+        raise HTTPException(status_code=422, detail=errors)
+    return {"inserted": users, "errors": errors}
+
+
+@router.patch("/{user_id}", status_code=204)
+async def update_user(user_id: UserId, update_data: UpdateUser):
+    async with writers.slot(_ITEM):
+        matched, errors = await user_crud.bulk_update(
+            [(GetUser(ids=[user_id]), update_data)]
+        )
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    if not matched:
+        raise HTTPException(status_code=404)
+
+
+@router.patch("/")
+async def update_users(
+    update_data: Annotated[
+        List[BatchUpdateUser], Body(min_length=1, max_length=_MAX_BULK_UPDATE)
+    ],
+):
+    """One bulk_write for the whole batch, errors carry the index of the item"""
+    async with writers.slot(_BULK, adapt=False):
+        matched, errors = await user_crud.bulk_update(
+            [(GetUser(ids=[item.id]), item) for item in update_data]
+        )
+    return {"matched": matched, "errors": errors}
+
+
+@router.delete("/{user_id}", status_code=204)
+async def delete_user(user_id: UserId):
+    async with writers.slot(_ITEM):
+        deleted = await user_crud.delete(GetUser(ids=[user_id]))
+    if not deleted:
+        raise HTTPException(status_code=404)
+
+
+@router.delete("/", status_code=204)
+async def delete_users(
+    ids: Annotated[
+        List[Annotated[str, Field(pattern=OBJECT_ID_PATTERN)]],
+        Body(min_length=1, max_length=_MAX_BULK_DELETE),
+    ],
+):
+    """One delete_many of every id, 404 when none of them existed"""
+    async with writers.slot(_BULK, adapt=False):
+        deleted = await user_crud.delete(GetUser(ids=ids))
+    if not deleted:
+        raise HTTPException(status_code=404)
+
+
+def _users_response(
+    users: List[BaseModel] | None, query: GetUser, headers: Dict[str, str]
+) -> Response:
+    if not users:
+        raise HTTPException(status_code=404)
+    if query.limit is not None and len(users) == query.limit:
+        headers["X-Next-Cursor"] = encode_cursor(query.sort, users[-1])
+    return Response(
+        user_crud.encode_response(users),
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Weak comparison against every tag of If-None-Match"""
+    if not if_none_match:
+        return False
+    return any(
+        tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(",")
+    )
+
+
+async def _ndjson(query: GetUser) -> AsyncIterator[bytes]:
+    async for user in user_crud.stream(query):
+        yield user.model_dump_json(by_alias=True).encode() + b"\n"
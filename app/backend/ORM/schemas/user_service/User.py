@@ -1,15 +1,119 @@
-from pydantic import BaseModel, Field
-from typing import List
+from datetime import datetime
+from pydantic import BaseModel, Field, model_validator
+from typing import Dict, List, Literal
+from helpers.pagination import MAX_PAGE_SIZE, decode_cursor
+from models.DataManager import BadArgs
+
+MAX_SEARCH_RESULTS = 50
+OBJECT_ID_PATTERN = r"^[0-9a-fA-F]{24}$"
+
+UserField = Literal[
+    "_id",
+    "nickname",
+    "gender",
+    "league_roles",
+    "riot_accounts",
+    "created_at",
+    "socials",
+]
+# fields of Socials, update keys become socials.<network> paths
+SocialNetwork = Literal[
+    "discord",
+    "telegram",
+    "vkontakte",
+    "youtube",
+    "twitch",
+    "boosty",
+]
 
 
 class GetUser(BaseModel):
     ids: List[str] | None = Field(None)
     nicknames: List[str] | None = Field(None)
     gender: str | None = Field(None)
-    roles: List[str] | None = Field(None)
+    roles: List[str] | None = Field(
+        None,
+        description="league_roles holding all of them, any of them without conjuction",
+    )
+    created_after: datetime | None = Field(
+        None, description="created_at >= , inclusive"
+    )
+    created_before: datetime | None = Field(
+        None, description="created_at < , exclusive"
+    )
     conjuction: bool = Field(True)
+    limit: int | None = Field(
+        None,
+        ge=1,
+        le=MAX_PAGE_SIZE,
+        description="DEFAULT_PAGE_SIZE without ids or nicknames, ndjson isn't paged",
+    )
+    cursor: str | None = Field(None, description="X-Next-Cursor of the previous page")
+    sort: Literal["_id", "created_at"] = Field("_id")
+    fields: List[UserField] | None = Field(
+        None,
+        description="Projection, _id, nickname and the sort field are always returned",
+    )
+
+    @model_validator(mode="after")
+    def check_created_range(self):
+        if (
+            self.created_after is not None
+            and self.created_before is not None
+            and self.created_after >= self.created_before
+        ):
+            raise ValueError("created_after must be before created_before")
+        return self
+
+    @model_validator(mode="after")
+    def check_cursor(self):
+        if self.cursor is not None:
+            try:
+                sort, _ = decode_cursor(self.cursor)
+            except BadArgs as e:
+                raise ValueError(e.details)
+            if sort != self.sort:
+                raise ValueError("Cursor belongs to another sort")
+        return self
+
+
+class SearchUser(BaseModel):
+    prefix: str = Field(..., min_length=1, max_length=100)
+    limit: int = Field(10, ge=1, le=MAX_SEARCH_RESULTS)
 
 
 class CreateUser(BaseModel):
-    nickname: str = Field(...)
+    nickname: str = Field(..., min_length=1, max_length=100)
     gender: str = Field(default="")
+
+
+class UpdateUser(BaseModel):
+    """Fields to change, the ones left out (or null) keep their value"""
+
+    nickname: str | None = Field(None, min_length=1, max_length=100)
+    gender: str | None = Field(None, max_length=750)
+    league_roles: List[str] | None = Field(None, min_length=1, max_length=5)
+    riot_accounts: List[str] | None = Field(None)
+    add_riot_accounts: List[str] | None = Field(
+        None, min_length=1, description="Added to riot_accounts unless present"
+    )
+    socials: Dict[SocialNetwork, Dict[str, str]] | None = Field(
+        None, description="Networks to replace, {} removes a network"
+    )
+
+    @model_validator(mode="after")
+    def check_changes(self):
+        if all(getattr(self, name) is None for name in UpdateUser.model_fields):
+            raise ValueError("Nothing to update")
+        if self.riot_accounts is not None and self.add_riot_accounts is not None:
+            raise ValueError("Use either riot_accounts or add_riot_accounts")
+        for account in (self.socials or {}).values():
+            if any("." in key or key.startswith("$") for key in account):
+                raise ValueError(
+                    "Social account keys can't contain '.' or start with '$'"
+                )
+        return self
+
+
+class BatchUpdateUser(UpdateUser):
+    id: str = Field(..., pattern=OBJECT_ID_PATTERN)
@@ -0,0 +1,72 @@
+"""Production entry point of the ORM service
+
+run from the ORM directory:
+    python serve.py [--host 0.0.0.0] [--port 8000] [--workers N]
+
+Workers default to WEB_CONCURRENCY, or the CPUs this container may use.
+uvicorn picks uvloop and httptools when they are installed (server extra).
+The app is imported and the index sync (see setup.prepare) is done once here
+before the workers are spawned, so a broken deploy fails before binding and
+workers don't repeat the sync. On SIGTERM uvicorn stops accepting, waits up
+to SHUTDOWN_TIMEOUT seconds for in-flight requests, then every worker drains
+queued writes and closes its pools in the lifespan shutdown.
+"""
+
+from argparse import ArgumentParser
+from asyncio import run
+from importlib import import_module
+from math import ceil
+import os
+import uvicorn
+
+
+def cpu_count() -> int:
+    """CPUs this process may use, a cgroup v2 CPU quota included"""
+    count = os.process_cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as file:
+            quota, period = file.read().split()
+        if quota != "max":
+            count = min(count, max(1, ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return count
+
+
+def preload() -> None:
+    # import errors surface before any worker starts
+    import_module("main")
+    from setup import prepare
+
+    if os.getenv("MONGO_SYNC_INDEXES", "1") == "1":
+        run(prepare())
+    # inherited by the workers, the sync above is enough
+    os.environ["MONGO_SYNC_INDEXES"] = "0"
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    # compose passes WEB_CONCURRENCY empty when it isn't set
+    workers = os.getenv("WEB_CONCURRENCY")
+    parser.add_argument(
+        "--workers", type=int, default=int(workers) if workers else None
+    )
+    args = parser.parse_args()
+
+    preload()
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers or cpu_count(),
+        loop="auto",
+        http="auto",
+        timeout_graceful_shutdown=int(os.getenv("SHUTDOWN_TIMEOUT", "20")),
+        access_log=os.getenv("ACCESS_LOG", "1") == "1",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,148 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from db_clients import MongoDB, DragonClient
+from models.data_managers.LocalManager import LocalManager
+from helpers.CRUD_instances import user_crud
+from helpers.admission import AdaptiveLimiter, Overloaded
+from helpers.metrics import metrics
+from models.DataManager import ReadFail
+from typing import Any, Dict, Iterator
 import os
 
 
+async def sync_indexes() -> None:
+    """Reconciles declared indexes and warns about query shapes scanning collections"""
+    explain = os.getenv("MONGO_EXPLAIN_QUERY_SHAPES", "1") == "1"
+    for manager in user_crud.data_managers:
+        if not hasattr(manager, "sync_indexes"):
+            continue
+        storage = manager._get_data_storage()
+        try:
+            report = await manager.sync_indexes()
+            for status, names in report.items():
+                if names:
+                    print(f"{storage} indexes {status}: {names}")
+        except Exception as e:
+            print(f"{storage} index sync failed: {e}")
+        if not explain:
+            continue
+        try:
+            if scans := await manager.find_collection_scans():
+                print(f"WARNING {storage} query shapes doing COLLSCAN: {scans}")
+        except Exception as e:
+            print(f"{storage} query shape explain failed: {e}")
+
+
+async def prepare() -> None:
+    """Startup work done once per deployment, serve.py runs it before the workers"""
+    await MongoDB.connect(os.getenv("MONGO_DB_URI", ""), "Akiora")
+    try:
+        await sync_indexes()
+    finally:
+        await MongoDB.disconnect()
+
+
+def _env_int(name: str, default: int | None) -> int | None:
+    value = os.getenv(name, "")
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float | None) -> float | None:
+    value = os.getenv(name, "")
+    return float(value) if value else default
+
+
+def mongo_pool_settings() -> Dict[str, Any]:
+    return {
+        "max_pool_size": _env_int("MONGO_MAX_POOL_SIZE", 100),
+        "min_pool_size": _env_int("MONGO_MIN_POOL_SIZE", 10),
+        "max_idle_time_ms": _env_int("MONGO_MAX_IDLE_TIME_MS", 300_000),
+        "wait_queue_timeout_ms": _env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000),
+        "server_selection_timeout_ms": _env_int(
+            "MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000
+        ),
+        "connect_timeout_ms": _env_int("MONGO_CONNECT_TIMEOUT_MS", 10000),
+        "socket_timeout_ms": _env_int("MONGO_SOCKET_TIMEOUT_MS", None),
+    }
+
+
+def dragon_pool_settings() -> Dict[str, Any]:
+    return {
+        "max_connections": _env_int("REDIS_MAX_CONNECTIONS", 100),
+        "pool_timeout": _env_float("REDIS_POOL_TIMEOUT", 5.0),
+        "socket_timeout": _env_float("REDIS_SOCKET_TIMEOUT", None),
+        "socket_connect_timeout": _env_float("REDIS_CONNECT_TIMEOUT", 5.0),
+        "socket_keepalive": os.getenv("REDIS_SOCKET_KEEPALIVE", "1") == "1",
+        "health_check_interval": _env_int("REDIS_HEALTH_CHECK_INTERVAL", 30),
+    }
+
+
+def collect_gauges() -> Iterator[tuple]:
+    """single flight, routing, admission and L1 state, read when /metrics is scraped"""
+    for name, value in user_crud.single_flight.stats().items():
+        yield f"orm_single_flight_{name}", {"crud": user_crud.model.__name__}, value
+    for manager, stats in user_crud.router.stats().items():
+        labels = {"crud": user_crud.model.__name__, "manager": manager}
+        for name, value in stats.items():
+            yield f"orm_router_{name}", labels, value
+    for limiter in AdaptiveLimiter._registry.values():
+        for name, value in limiter.stats().items():
+            yield f"orm_limiter_{name}", {"limiter": limiter.name}, value
+    for name, batcher in user_crud.batchers.items():
+        yield "orm_write_batcher_queued", {"batcher": name}, batcher.stats()["queued"]
+    for manager in LocalManager._registry.values():
+        labels = {"manager": manager.__name__}
+        for name, value in manager.stats().items():
+            yield f"orm_l1_{name}", labels, value
+    for client, name in ((MongoDB, "mongo"), (DragonClient, "dragon")):
+        for stat, value in client.pool_stats().items():
+            yield f"orm_pool_{stat}", {"client": name}, value
+
+
+metrics.add_collector(collect_gauges)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     mongo_uri = os.getenv("MONGO_DB_URI", "")
     redis_uri = os.getenv("REDIS_URI", "")
 
+    mongo_settings = mongo_pool_settings()
     try:
-        await MongoDB.connect(mongo_uri, "Akiora")
+        await MongoDB.connect(mongo_uri, "Akiora", **mongo_settings)
     except Exception as e:
         print(f"MongoDB connection failed: {e}")
         raise
 
     try:
-        await DragonClient.connect(redis_uri)
+        await DragonClient.connect(redis_uri, **dragon_pool_settings())
     except Exception as e:
         print(f"Redis connection failed: {e}")
         raise
 
+    # first requests after a deploy shouldn't pay the connect cost
+    try:
+        await MongoDB.warmup(mongo_settings["min_pool_size"])
+    except Exception as e:
+        print(f"MongoDB pool warmup failed: {e}")
+    try:
+        await DragonClient.warmup(_env_int("REDIS_MIN_CONNECTIONS", 10))
+    except Exception as e:
+        print(f"Redis pool warmup failed: {e}")
+
+    if os.getenv("MONGO_SYNC_INDEXES", "1") == "1":
+        await sync_indexes()
+    await LocalManager.start_listener()
+
     yield
+    # uvicorn stops accepting and waits for in-flight requests before this
+    try:
+        await user_crud.drain(_env_float("SHUTDOWN_DRAIN_TIMEOUT", 10.0))
+    except Exception as e:
+        print(f"Draining pending writes failed: {e}")
+    await LocalManager.stop_listener()
     await MongoDB.disconnect()
     await DragonClient.disconnect()
 
@@ -38,14 +158,40 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """Shed requests fail fast, clients retry once the queue went through"""
+    return JSONResponse(
+        {"detail": "Overloaded"},
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(ReadFail)
+async def read_fail_handler(request: Request, exc: ReadFail):
+    """No manager could answer, a partial result isn't served instead"""
+    return JSONResponse({"detail": exc.details}, status_code=503)
+
+
 @app.get("/health")
-async def test_endpoint():
-    mongo = MongoDB.get_db()
-    collection = mongo["test_collection"]
-    await collection.insert_one({"test": "document"})
+async def health_endpoint():
+    """Read only pings and pool utilization, 503 when a backend is down"""
+    body = {}
+    healthy = True
+    for client, name in ((MongoDB, "mongo"), (DragonClient, "redis")):
+        try:
+            latency = await client.ping()
+            body[name] = {"status": "ok", "ping_ms": round(latency * 1e3, 2)}
+        except Exception as e:
+            healthy = False
+            body[name] = {"status": "down", "error": str(e)}
+        body[name]["pool"] = client.pool_stats()
+    return JSONResponse(body, status_code=200 if healthy else 503)
 
-    redis = DragonClient.get_client()
-    await redis.set("test_key", "test_value")
-    value = await redis.get("test_key")
 
-    return {"mongo": "ok", "redis": value}
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )